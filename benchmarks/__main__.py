@@ -0,0 +1,313 @@
+'''
+Offline benchmarks for the crawler, ingest and poem builder.
+
+    python -m benchmarks [--only extract crawl ingest poem] [--output FILE]
+
+Results are written as JSON so that runs can be compared between releases.
+Nothing here touches the network: pages are synthetic (or loaded from
+--fixtures) and served from memory or from a local stub server.
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import mean, median
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask
+
+from rabbit.article import Article
+from rabbit.crawler import Crawler
+from rabbit.discovery import Discovery
+from rabbit.extractor import ArticleExtractor
+from rabbit.logger import logger
+from rabbit.markov import DailyModelCache
+from rabbit.poem import build_poems, get_scope_map
+from rabbit.scheduler import Scheduler
+from rabbit.scraper import Scraper
+from rabbit.state import CrawlState
+from rabbit.web.poem import PoemType
+from rabbit.web.storage import (
+    add_or_update_article,
+    add_or_update_articles,
+    initialise_storage
+)
+
+from .fixtures import HOSTNAME, article_pages, article_path, load_pages
+from .stub import ReplayAdapter, StubAdapter, StubServer, mount
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'total': sum(ordered),
+        'mean': mean(ordered),
+        'median': median(ordered),
+        'p95': ordered[int(0.95 * (len(ordered) - 1))],
+        'max': ordered[-1]
+    }
+
+
+def timed(func: Callable, *args, **kwargs) -> float:
+    start = perf_counter()
+    func(*args, **kwargs)
+    return perf_counter() - start
+
+
+def benchmark_extract(options: argparse.Namespace) -> dict:
+    '''Per-page extraction, with and without the Scraper around it.'''
+    pages = load_pages(options.fixtures) if options.fixtures \
+        else article_pages(options.pages)
+    mount(ReplayAdapter(pages), [HOSTNAME])
+
+    def extract(page: bytes) -> None:
+        extractor = ArticleExtractor()
+        extractor.feed(page.decode())
+        extractor.close()
+
+    extract_samples = [timed(extract, i) for i in pages.values()]
+    scrape_samples = [
+        timed(lambda url: Article.from_scraper(Scraper(url)), i)
+        for i in pages
+    ]
+
+    return {
+        'pages': len(pages),
+        'bytes': sum(map(len, pages.values())),
+        'extract_seconds': summarise(extract_samples),
+        'scrape_seconds': summarise(scrape_samples)
+    }
+
+
+def benchmark_crawl(options: argparse.Namespace) -> dict:
+    '''A full crawl of the stub server's link graph.'''
+    server = StubServer(options.pages, options.fanout, options.latency).start()
+    mount(StubAdapter(server.url), [HOSTNAME])
+
+    try:
+        crawler = Crawler(
+            [f'https://{HOSTNAME}{article_path(i)}' for i in range(options.seeds)],
+            max_workers=options.workers,
+            parse_workers=options.parse_workers
+        )
+        start = perf_counter()
+        articles = sum(1 for _ in crawler.crawl())
+        elapsed = perf_counter() - start
+    finally:
+        server.stop()
+
+    return {
+        'articles': articles,
+        'requests': server.requests,
+        'seconds': elapsed,
+        'pages_per_second': server.requests / elapsed,
+        'latency': options.latency,
+        'workers': options.workers,
+        'parse_workers': crawler.parse_workers
+    }
+
+
+def benchmark_discovery(options: argparse.Namespace) -> dict:
+    '''
+    Requests needed to find articles by following links, compared with
+    reading the stub's feed and sitemap, then reading them again unchanged.
+    '''
+    server = StubServer(
+        options.pages,
+        options.fanout,
+        latency=0,
+        feed_size=options.feed_size
+    ).start()
+    mount(StubAdapter(server.url), [HOSTNAME])
+    seeds = [f'https://{HOSTNAME}{article_path(i)}' for i in range(options.seeds)]
+    feeds = [f'https://{HOSTNAME}/rss.xml', f'https://{HOSTNAME}/sitemap-index.xml']
+    results = {}
+
+    def crawl(urls: List[str], max_depth: int) -> dict:
+        requests = server.requests
+        crawler = Crawler(
+            urls,
+            state=state,
+            max_workers=options.workers,
+            parse_workers=options.parse_workers,
+            max_depth=max_depth
+        )
+        articles = 0
+
+        # Every article counts as ingested, so its download is recorded.
+        for article in crawler.crawl():
+            crawler.commit(article)
+            articles += 1
+
+        return {'articles': articles, 'requests': server.requests - requests}
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            state = CrawlState(os.path.join(directory, 'links.db'))
+            results['links'] = crawl(seeds, 3)
+
+            state = CrawlState(os.path.join(directory, 'feeds.db'))
+            discovery = Discovery(feeds, state)
+
+            for name in ('feeds', 'feeds_unchanged'):
+                requests = server.requests
+                urls = discovery.discover()
+                results[name] = {
+                    'discovered': len(urls),
+                    'discovery_requests': server.requests - requests,
+                    **crawl(urls, 0)
+                }
+                discovery.commit()
+    finally:
+        server.stop()
+
+    return results
+
+
+def benchmark_ingest(options: argparse.Namespace) -> dict:
+    '''Single and batched ingest into a fresh SQLite database.'''
+    pages = article_pages(options.articles, fanout=0)
+    mount(ReplayAdapter(pages), [HOSTNAME])
+    articles = [Article.from_scraper(Scraper(i)) for i in pages]
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f'sqlite:///{os.path.join(directory, "benchmark.db")}'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        initialise_storage(app)
+
+        with app.app_context():
+            def ingest_single() -> List[float]:
+                return [
+                    timed(
+                        add_or_update_article,
+                        i.url, i.title, i.category, i.date, i.content
+                    )
+                    for i in articles
+                ]
+
+            def ingest_batches() -> float:
+                return sum(
+                    timed(add_or_update_articles, articles[i:i + options.batch_size])
+                    for i in range(0, len(articles), options.batch_size)
+                )
+
+            created = ingest_single()
+            updated = ingest_single()
+            batched = ingest_batches()
+
+    return {
+        'articles': len(articles),
+        'create_seconds': summarise(created),
+        'update_seconds': summarise(updated),
+        'batch_size': options.batch_size,
+        'batch_articles_per_second': len(articles) / batched
+    }
+
+
+def benchmark_poem(options: argparse.Namespace) -> dict:
+    '''build_poems for every scope, first from scratch and then from cache.'''
+    server = StubServer(latency=0, articles_per_day=options.articles_per_day).start()
+    os.environ['RABBIT_POEMS_ENDPOINT'] = f'{server.url}/poems'
+    os.environ.setdefault('RABBIT_API_KEY', 'benchmark')
+    results = {'articles_per_day': options.articles_per_day}
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            model_cache = DailyModelCache(directory, f'{server.url}/text')
+            scope_map = get_scope_map(datetime.utcnow())
+
+            for poem_type in PoemType:
+                results[poem_type.value] = {
+                    'days': len(scope_map[poem_type].days()),
+                    'cold_seconds': timed(
+                        build_poems, scope_map, poem_type, model_cache
+                    ),
+                    'warm_seconds': timed(
+                        build_poems, scope_map, poem_type, model_cache
+                    )
+                }
+    finally:
+        server.stop()
+
+    return results
+
+
+BENCHMARKS = {
+    'extract': benchmark_extract,
+    'crawl': benchmark_crawl,
+    'discovery': benchmark_discovery,
+    'ingest': benchmark_ingest,
+    'poem': benchmark_poem
+}
+
+
+def revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            check=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--output', help='write results here instead of stdout')
+    parser.add_argument('--fixtures', help='directory of saved .html pages to extract')
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--seeds', type=int, default=4)
+    parser.add_argument('--feed-size', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--parse-workers', type=int, help='defaults to the number of cores')
+    parser.add_argument('--rate', type=float, default=1000.0)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--articles-per-day', type=int, default=20)
+    options = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    # Politeness limits would otherwise dominate every timing.
+    Scraper.scheduler = Scheduler(
+        rate=options.rate,
+        burst=options.workers,
+        max_concurrency=options.workers
+    )
+
+    results = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'started': datetime.utcnow().isoformat(),
+        'options': vars(options),
+        'results': {}
+    }
+
+    for name in options.only:
+        print(f'Running {name} benchmark.', file=sys.stderr)
+        results['results'][name] = BENCHMARKS[name](options)
+
+    output = json.dumps(results, indent=2)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime
+from random import Random
+from typing import Dict, List
+
+
+HOSTNAME = 'www.bbc.co.uk'
+
+WORDS = (
+    'government minister said the people council report police health '
+    'service year new country week public official plans money school '
+    'company million thousand family children city world week first last '
+    'told announced warned expected could would should after before during '
+    'under over against through business market prices energy climate '
+    'election vote party leader court judge hospital patients staff '
+    'workers union strike research scientists study found data water'
+).split()
+
+SECTIONS = (
+    'UK', 'World', 'Business', 'Politics', 'Technology',
+    'Science & Environment', 'Health', 'Education', 'Entertainment & Arts'
+)
+
+
+def sentence(random: Random) -> str:
+    words = random.choices(WORDS, k=random.randint(8, 24))
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(random: Random) -> str:
+    return ' '.join(sentence(random) for _ in range(random.randint(1, 3)))
+
+
+def article_path(n: int) -> str:
+    return f'/news/article-{n}'
+
+
+def article_page(n: int, links: List[str], paragraphs: int = 20) -> str:
+    '''
+    A synthetic page laid out like a BBC News article, with the same
+    markup the extractor looks for and a realistic amount of surrounding
+    navigation.
+    '''
+    random = Random(n)
+    published = datetime(2020, 1, 1, tzinfo=timezone.utc) + \
+        timedelta(minutes=random.randint(0, 365 * 24 * 60))
+    navigation = ''.join(
+        f'<li><a href="/news/{i.lower().replace(" ", "_")}">{i}</a></li>'
+        for i in SECTIONS
+    )
+    blocks = ''.join(
+        '<div data-component="text-block"><div class="ssrcss-block">'
+        f'<p>{paragraph(random)}</p></div></div>'
+        for _ in range(paragraphs)
+    )
+    related = ''.join(f'<li><a href="{i}">{sentence(random)}</a></li>' for i in links)
+
+    return (
+        '<!DOCTYPE html><html lang="en-GB"><head>'
+        f'<title>{sentence(random)} - BBC News</title>'
+        f'<meta property="article:section" content="{random.choice(SECTIONS)}"/>'
+        '<meta name="viewport" content="width=device-width, initial-scale=1"/>'
+        '<script>window.__INITIAL_DATA__ = {};</script>'
+        f'</head><body><header><nav><ul>{navigation}</ul></nav></header>'
+        '<main id="main-content"><article>'
+        f'<header><h1 id="main-heading">{sentence(random)}</h1></header>'
+        f'<div data-component="byline-block"><time datetime="'
+        f'{published.strftime("%Y-%m-%dT%H:%M:%S.000Z")}">'
+        f'{published.strftime("%d %B %Y")}</time></div>'
+        f'{blocks}'
+        '<div data-component="links-block"><ul>'
+        f'{related}</ul></div>'
+        '</article></main>'
+        f'<footer><ul>{navigation}</ul></footer></body></html>'
+    )
+
+
+def link_graph(pages: int, fanout: int, seed: int = 0) -> Dict[int, List[int]]:
+    random = Random(seed)
+    return {
+        i: random.sample(range(pages), min(fanout, pages))
+        for i in range(pages)
+    }
+
+
+def article_pages(count: int, fanout: int = 8) -> Dict[str, bytes]:
+    graph = link_graph(count, fanout)
+    return {
+        f'https://{HOSTNAME}{article_path(i)}': article_page(
+            i,
+            [article_path(j) for j in graph[i]]
+        ).encode()
+        for i in range(count)
+    }
+
+
+def _modified(n: int) -> datetime:
+    return datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(hours=n)
+
+
+def rss_feed(articles: List[int]) -> str:
+    items = ''.join(
+        f'<item><title>{sentence(Random(i))}</title>'
+        f'<link>https://{HOSTNAME}{article_path(i)}?at_medium=RSS</link>'
+        f'<guid isPermaLink="false">article-{i}</guid>'
+        f'<pubDate>{format_datetime(_modified(i))}</pubDate></item>'
+        for i in articles
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+        f'<channel><title>BBC News</title><link>https://{HOSTNAME}/news</link>'
+        f'<image><url>https://{HOSTNAME}/logo.gif</url></image>'
+        f'{items}</channel></rss>'
+    )
+
+
+def news_sitemap(articles: List[int]) -> str:
+    urls = ''.join(
+        f'<url><loc>https://{HOSTNAME}{article_path(i)}</loc><news:news>'
+        f'<news:publication_date>{_modified(i).isoformat()}'
+        '</news:publication_date></news:news></url>'
+        for i in articles
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+        'xmlns:news="http://www.google.com/schemas/sitemap-news/0.9">'
+        f'{urls}</urlset>'
+    )
+
+
+def sitemap_index(sitemaps: List[str]) -> str:
+    entries = ''.join(
+        f'<sitemap><loc>{i}</loc>'
+        f'<lastmod>{_modified(0).strftime("%Y-%m-%dT%H:%M:%SZ")}</lastmod></sitemap>'
+        for i in sitemaps
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f'{entries}</sitemapindex>'
+    )
+
+
+def load_pages(directory: str) -> Dict[str, bytes]:
+    '''Load saved pages, addressed by their file name without .html.'''
+    pages = {}
+
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'rb') as file:
+                pages[f'https://{HOSTNAME}/news/{name[:-5]}'] = file.read()
+
+    return pages
+
+
+def day_text(day: date, articles: int, paragraphs: int = 8) -> str:
+    '''Text for one day, as /api/text would return it.'''
+    random = Random(datetime.combine(day, time.min).toordinal())
+    return '\n'.join(
+        paragraph(random)
+        for _ in range(articles * paragraphs)
+    )
@@ -0,0 +1,165 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse, urlunparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from rabbit.scraper import Scraper
+
+from .fixtures import article_page, article_path, day_text, HOSTNAME, \
+    link_graph, news_sitemap, rss_feed, sitemap_index
+
+
+class StubServer(ThreadingHTTPServer):
+    '''
+    Serves synthetic articles linked into a random graph, an RSS feed and
+    news sitemap listing the newest of them, day text for the poem builder
+    and a sink for poem uploads, each after a fixed latency.
+    '''
+
+    daemon_threads = True
+
+    def __init__(
+        self: object,
+        pages: int = 500,
+        fanout: int = 8,
+        latency: float = 0.05,
+        articles_per_day: int = 20,
+        feed_size: int = 30
+    ):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.graph = link_graph(pages, fanout)
+        self.latency = latency
+        self.articles_per_day = articles_per_day
+        self.feed_size = feed_size
+        self.requests = 0
+
+    @property
+    def url(self: object) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self: object) -> 'StubServer':
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self: object) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def feed(self: object, path: str) -> Optional[bytes]:
+        newest = list(range(len(self.graph) - 1, -1, -1))[:self.feed_size]
+
+        if path == '/rss.xml':
+            return rss_feed(newest).encode()
+        if path == '/sitemap.xml':
+            return news_sitemap(newest).encode()
+        if path == '/sitemap-index.xml':
+            return sitemap_index([f'https://{HOSTNAME}/sitemap.xml']).encode()
+
+        return None
+
+    def page(self: object, path: str) -> Optional[bytes]:
+        if not path.startswith('/news/article-'):
+            return None
+
+        try:
+            n = int(path[len('/news/article-'):])
+        except ValueError:
+            return None
+
+        if n not in self.graph:
+            return None
+
+        return article_page(n, [article_path(i) for i in self.graph[n]]).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self: object, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self: object):
+        self.server.requests += 1
+        sleep(self.server.latency)
+        url = urlparse(self.path)
+
+        if url.path == '/text':
+            day = datetime.fromisoformat(parse_qs(url.query)['from'][0]).date()
+            body = day_text(day, self.server.articles_per_day).encode()
+            self._send(200, body, 'text/plain; charset=utf-8')
+            return
+
+        feed = self.server.feed(url.path)
+
+        if feed is not None:
+            self._send(200, feed, 'application/xml')
+            return
+
+        page = self.server.page(url.path)
+
+        if page is None:
+            self._send(404, b'Not found', 'text/plain')
+        else:
+            self._send(200, page, 'text/html; charset=utf-8')
+
+    def do_POST(self: object):
+        self.server.requests += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send(201, b'{}', 'application/json')
+
+    def log_message(self: object, *args) -> None:
+        pass
+
+
+class StubAdapter(HTTPAdapter):
+    '''Sends requests for any host to the stub server instead.'''
+
+    def __init__(self: object, base_url: str):
+        super().__init__(pool_maxsize=32)
+        self.base_url = urlparse(base_url)
+
+    def send(self: object, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        url = urlparse(request.url)
+        request.url = urlunparse(url._replace(
+            scheme=self.base_url.scheme,
+            netloc=self.base_url.netloc
+        ))
+        return super().send(request, **kwargs)
+
+
+class ReplayAdapter(BaseAdapter):
+    '''Answers requests from saved pages without touching the network.'''
+
+    def __init__(self: object, pages: Dict[str, bytes]):
+        super().__init__()
+        self.pages = pages
+
+    def send(self: object, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 200 if request.url in self.pages else 404
+        response._content = self.pages.get(request.url, b'')
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        return response
+
+    def close(self: object) -> None:
+        pass
+
+
+def mount(adapter: BaseAdapter, hostnames: List[str]) -> None:
+    '''Route the scraper's sessions for the given hosts through adapter.'''
+    for hostname in hostnames:
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        Scraper.sessions[hostname] = session
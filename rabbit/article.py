@@ -1,12 +1,14 @@
 import json
 from datetime import datetime
 from hashlib import md5
-from typing import List
+from typing import List, Sequence
 
 from .scraper import Scraper
 
 
 class Article:
+    __slots__ = ('url', 'title', 'date', 'content', 'related', 'category')
+
     @staticmethod
     def from_scraper(scraper: Scraper):
         url = scraper.url
@@ -26,17 +28,20 @@ class Article:
         title: str,
         date: datetime,
         content: List[str],
-        related: List[str],
+        related: Sequence[str],
         category: str
     ):
         self.url = url
         self.title = title
         self.date = date
         self.content = content
-        self.related = related
+        self.related = tuple(related)
         self.category = category
 
-    def __hash__(self: object) -> str:
+    def __hash__(self: object) -> int:
+        return int(self.hash(), 16)
+
+    def hash(self: object) -> str:
         return md5(json.dumps(self.json()).encode()).hexdigest()[:16]
 
     def json(self: object) -> dict:
@@ -1,81 +1,398 @@
-from collections import namedtuple
-from concurrent.futures import as_completed, ThreadPoolExecutor
-from os import environ
-from typing import Generator, List
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from os import cpu_count, environ
+from time import monotonic, sleep
+from typing import AsyncGenerator, Dict, Generator, List, Optional, Tuple, Union
 
 import requests
-from requests.api import head
 
 from .article import Article
+from .discovery import DEFAULT_FEEDS, Discovery, SECTION_URLS
+from .frontier import BloomFilter, QueueItem, VisitedSet
 from .logger import logger
-from .scraper import Scraper, ScraperError
+from .metrics import registry, start_metrics_server
+from .scraper import Download, NotModifiedError, Scraper, ScraperError
+from .state import CrawlState, IngestCache
 
 
-QueueItem = namedtuple('QueueItem', ['url', 'depth'])
+crawled_pages = registry.counter(
+    'rabbit_crawler_pages_total',
+    'Pages processed by the crawler, by outcome and depth.',
+    ['result', 'depth']
+)
+frontier_size = registry.gauge(
+    'rabbit_crawler_frontier_size',
+    'URLs queued and waiting for a worker.'
+)
+parse_seconds = registry.histogram(
+    'rabbit_crawler_parse_seconds',
+    'Time taken to extract an article from a page.'
+)
+parse_queue_size = registry.gauge(
+    'rabbit_crawler_parse_queue_size',
+    'Downloaded pages waiting for a parse worker.'
+)
+upload_seconds = registry.histogram(
+    'rabbit_crawler_upload_seconds',
+    'Time taken to upload a batch of articles to the web API.'
+)
 
 
 class Crawler:
-    def __init__(self: object, url_list: List[str]):
-        self.max_depth = 3
-        self.queue = set(QueueItem(i, 0) for i in url_list)
-        self.visited_sites = set()
+    '''
+    Crawls outwards from a list of seed URLs in two stages.
 
-    def _append_queue(self: object, url: str, depth: int):
-        if url in self.visited_sites:
-            return
+    Fetch workers download pages on a thread pool, and parse workers turn
+    them into articles on a process pool of parse_workers processes, so
+    that extraction is not limited by the GIL. Bounded queues between the
+    stages stop fetching from running too far ahead of parsing. With no
+    parse workers, extraction runs on the fetch thread pool instead.
 
-        self.queue += [QueueItem(url, depth)]
-        self.visited_sites.add(url)
+    Validators of crawled articles are only written to the crawl state once
+    commit is called, so that an article which fails to upload is fetched
+    again on the next pass.
+    '''
 
-    def get_article(self: object, url: str) -> Article:
-        return Article.from_scraper(Scraper(url))
+    def __init__(
+        self: object,
+        url_list: List[str],
+        max_workers: int = 16,
+        state: Optional[CrawlState] = None,
+        visited_sites: Union[BloomFilter, VisitedSet, None] = None,
+        parse_workers: Optional[int] = None,
+        max_depth: int = 3
+    ):
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+        self.parse_workers = cpu_count() if parse_workers is None \
+            else parse_workers
+        self.state = state
+        self.pending: Dict[str, Download] = {}
+        self.queue = [QueueItem(i, 0) for i in url_list]
+        self.visited_sites = VisitedSet() if visited_sites is None \
+            else visited_sites
+
+        for url in url_list:
+            self.visited_sites.add(url)
+
+    def _append_queue(self: object, url: str, depth: int) -> bool:
+        if not self.visited_sites.add(url):
+            return False
+
+        self.queue.put_nowait(QueueItem(url, depth))
+
+        return True
+
+    def _expand(self: object, related: List[str], depth: int) -> int:
+        discovered = 0
+
+        # Expand the frontier straight away so that idle workers can pick
+        # up new links without waiting for the consumer.
+        if depth < self.max_depth:
+            for related_url in related:
+                discovered += self._append_queue(related_url, depth + 1)
+            frontier_size.set(self.queue.qsize())
+
+        return discovered
+
+    def _record(self: object, download: Download, related: List[str]) -> None:
+        if self.state:
+            self.state.update(
+                download.url,
+                download.etag,
+                download.last_modified,
+                download.content_hash,
+                related
+            )
+
+    def commit(self: object, article: Article) -> None:
+        '''Record the download of an article once it has been ingested.'''
+        download = self.pending.pop(article.url, None)
+
+        if download:
+            self._record(download, article.related)
+
+    def _log_error(self: object, item: QueueItem, error: Exception) -> None:
+        url, depth = item
+        crawled_pages.inc(result='error', depth=depth)
+        logger.error(f'⚠️  {url} ({depth})')
+        logger.error(f'An exception occured: {error}')
+
+    async def _fetch(
+        self: object,
+        executor: ThreadPoolExecutor,
+        item: QueueItem
+    ) -> Tuple[Optional[Download], int]:
+        '''Download a page, or return the number of links discovered instead.'''
+        loop = asyncio.get_running_loop()
+        url, depth = item
+
+        try:
+            return await loop.run_in_executor(
+                executor, Scraper.download, url, self.state
+            ), 0
+        except NotModifiedError as error:
+            crawled_pages.inc(result='unchanged', depth=depth)
+            logger.info(f'❎ {url} ({depth}) {error}')
+
+            # Unchanged pages still lead to the links found last time.
+            page = self.state.get(url)
+            return None, self._expand(page.related if page else (), depth)
+        except ScraperError as error:
+            crawled_pages.inc(result='skipped', depth=depth)
+            logger.info(f'❎ {url} ({depth}) {error}')
+            return None, 0
+
+    async def _parse(
+        self: object,
+        executor: Executor,
+        item: QueueItem,
+        download: Download
+    ) -> Tuple[Optional[Article], int]:
+        '''Extract the article from a page, with the number of links discovered.'''
+        loop = asyncio.get_running_loop()
+        url, depth = item
+
+        try:
+            article, elapsed = await loop.run_in_executor(
+                executor, extract_article, url, download.content
+            )
+        except ScraperError as error:
+            crawled_pages.inc(result='skipped', depth=depth)
+            logger.info(f'❎ {url} ({depth}) {error}')
+
+            # Not an article, so there is nothing to upload first.
+            self._record(download, [])
+            return None, 0
+
+        parse_seconds.observe(elapsed)
+        crawled_pages.inc(result='article', depth=depth)
+        logger.info(f'✅ {url} ({depth})')
+
+        self.pending[article.url] = download
+        return article, self._expand(article.related, depth)
+
+    async def _fetch_worker(
+        self: object,
+        executor: ThreadPoolExecutor,
+        downloads: asyncio.Queue,
+        results: asyncio.Queue
+    ):
+        while True:
+            item = await self.queue.get()
+            frontier_size.set(self.queue.qsize())
+
+            # Whatever fails, each item is posted to results exactly once,
+            # here or by the parse worker, or crawl_async waits forever.
+            try:
+                download, discovered = await self._fetch(executor, item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                download, discovered = None, 0
+                self._log_error(item, error)
+
+            if download:
+                await downloads.put((item, download))
+                parse_queue_size.set(downloads.qsize())
+            else:
+                await results.put((item, None, discovered))
+
+    async def _parse_worker(
+        self: object,
+        executor: Executor,
+        downloads: asyncio.Queue,
+        results: asyncio.Queue
+    ):
+        while True:
+            item, download = await downloads.get()
+            parse_queue_size.set(downloads.qsize())
+
+            try:
+                article, discovered = await self._parse(executor, item, download)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                article, discovered = None, 0
+                self._log_error(item, error)
+
+            await results.put((item, article, discovered))
+
+    async def crawl_async(self: object) -> AsyncGenerator[Article, None]:
+        seeds, self.queue = self.queue, asyncio.Queue()
+        downloads = asyncio.Queue(maxsize=self.max_workers)
+        results = asyncio.Queue(maxsize=self.max_workers)
+
+        for item in seeds:
+            self.queue.put_nowait(item)
+
+        # Number of queued or in-flight items whose result is still pending.
+        pending = len(seeds)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as fetch_executor, \
+                self._parse_executor(fetch_executor) as parse_executor:
+            workers = [
+                asyncio.create_task(
+                    self._fetch_worker(fetch_executor, downloads, results)
+                )
+                for _ in range(self.max_workers)
+            ] + [
+                # Twice as many as processes, so none sit idle between pages.
+                asyncio.create_task(
+                    self._parse_worker(parse_executor, downloads, results)
+                )
+                for _ in range(max(1, self.parse_workers) * 2)
+            ]
+
+            try:
+                while pending > 0:
+                    _item, article, discovered = await results.get()
+                    pending += discovered - 1
+
+                    if article:
+                        yield article
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    def _parse_executor(self: object, fetch_executor: ThreadPoolExecutor) -> Executor:
+        if not self.parse_workers:
+            return nullcontext(fetch_executor)
+
+        # Spawned rather than forked, as the parent already runs threads.
+        return ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
 
     def crawl(self: object) -> Generator[Article, None, None]:
-        while len(self.queue) > 0:
-            with ThreadPoolExecutor(max_workers=16) as executor:
-                mapping = {executor.submit(self.get_article, i.url): i for i in self.queue}
-                self.queue = []
+        loop = asyncio.new_event_loop()
+        articles = self.crawl_async()
+
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(articles.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(articles.aclose())
+            loop.close()
 
-                for future in as_completed(mapping):
-                    url, depth = mapping[future]
 
-                    try:
-                        article = future.result()
-                        logger.info(f'✅ {url} ({depth})')
-                    except ScraperError as error:
-                        logger.info(f'❎ {url} ({depth}) {error}')
-                        continue
-                    except Exception as error:
-                        logger.error(f'⚠️  {url} ({depth})')
-                        logger.error(f'An exception occured: {error}')
+def extract_article(url: str, content: bytes) -> Tuple[Article, float]:
+    '''Build an article from a downloaded page, timing the extraction.'''
+    start = monotonic()
+    article = Article.from_scraper(Scraper(url, content=content))
+    return article, monotonic() - start
 
-                    yield article
 
-                    if depth < self.max_depth:
-                        for url in article.related:
-                            self._append_queue(url, depth + 1)
+def warm_ingest_cache(ingest_cache: IngestCache, url: str, days: int) -> None:
+    '''Reconcile the ingest cache with the hashes stored by the web API.'''
+    until = datetime.utcnow()
+    response = requests.get(f'{url}/hashes', params={
+        'from': (until - timedelta(days=days)).isoformat(),
+        'until': until.isoformat()
+    }, timeout=30)
+    response.raise_for_status()
+    ingest_cache.warm(response.json())
+
+
+def upload_articles(
+    ingest_cache: IngestCache,
+    url: str,
+    articles: List[Article]
+) -> None:
+    if not articles:
+        return
+
+    start = monotonic()
+    response = requests.post(
+        url,
+        headers={'X-Api-Key': 'test'},
+        json=[i.json() for i in articles]
+    )
+    response.raise_for_status()
+    upload_seconds.observe(monotonic() - start)
+
+    for article in articles:
+        ingest_cache.update(article.url, article.hash())
 
 
 if __name__ == '__main__':
+    start_metrics_server(int(environ.get('RABBIT_METRICS_PORT', 9100)))
+
+    state_path = environ.get('RABBIT_CRAWL_STATE', 'crawl_state.db')
+    state = CrawlState(state_path)
+    ingest_cache = IngestCache(
+        state_path,
+        int(environ.get('RABBIT_INGEST_CACHE_SIZE', 100000))
+    )
+    batch_size = int(environ.get('RABBIT_INGEST_BATCH_SIZE', 200))
+    visited_capacity = int(environ.get('RABBIT_VISITED_CAPACITY', 0))
+    visited_error_rate = float(environ.get('RABBIT_VISITED_ERROR_RATE', 0.001))
+    parse_workers = int(environ.get('RABBIT_PARSE_WORKERS', cpu_count()))
+
+    # With feed discovery, following links from the section pages is only
+    # needed now and then to backfill articles the feeds never listed.
+    feeds = environ['RABBIT_FEEDS'].split(',') if 'RABBIT_FEEDS' in environ \
+        else DEFAULT_FEEDS
+    discovery = Discovery(feeds, state) \
+        if environ.get('RABBIT_DISCOVERY', 'links') == 'feeds' else None
+    discovery_interval = int(environ.get('RABBIT_DISCOVERY_INTERVAL', 300))
+    backfill_interval = timedelta(
+        hours=float(environ.get('RABBIT_BACKFILL_HOURS', 24))
+    )
+    last_backfill = None
+
     while True:
-        crawler = Crawler([
-            'https://www.bbc.co.uk/news/uk',
-            'https://www.bbc.co.uk/news/world',
-            'https://www.bbc.co.uk/news/business',
-            'https://www.bbc.co.uk/news/politics',
-            'https://www.bbc.co.uk/news/technology',
-            'https://www.bbc.co.uk/news/science_and_environment',
-            'https://www.bbc.co.uk/news/health',
-            'https://www.bbc.co.uk/news/education',
-            'https://www.bbc.co.uk/news/entertainment_and_arts'
-        ])
+        # Bound memory with a Bloom filter when a capacity is configured.
+        visited_sites = BloomFilter(visited_capacity, visited_error_rate) \
+            if visited_capacity else VisitedSet()
+
+        warm_ingest_cache(
+            ingest_cache,
+            environ['RABBIT_WEB_URL'],
+            int(environ.get('RABBIT_INGEST_WARM_DAYS', 7))
+        )
+
+        if discovery and last_backfill and \
+                datetime.utcnow() - last_backfill < backfill_interval:
+            urls, max_depth = discovery.discover(), 0
+            logger.info(f'Discovered {len(urls)} new or updated articles.')
+        else:
+            urls, max_depth = SECTION_URLS, 3
+            last_backfill = datetime.utcnow()
+
+        crawler = Crawler(
+            urls,
+            state=state,
+            visited_sites=visited_sites,
+            parse_workers=parse_workers,
+            max_depth=max_depth
+        )
+        batch = []
         for article in crawler.crawl():
-            if not article.content:
-                # Do not process empty articles.
+            if not article.content or \
+                    ingest_cache.is_current(article.url, article.hash()):
+                # Empty, or already ingested and unchanged since.
+                crawler.commit(article)
                 continue
-            response = requests.post(
-                environ['RABBIT_WEB_URL'],
-                headers={'X-Api-Key': 'test'},
-                json=article.json()
-            )
-            response.raise_for_status()
+            batch.append(article)
+            if len(batch) >= batch_size:
+                upload_articles(ingest_cache, environ['RABBIT_BATCH_URL'], batch)
+                for i in batch:
+                    crawler.commit(i)
+                batch = []
+        upload_articles(ingest_cache, environ['RABBIT_BATCH_URL'], batch)
+        for article in batch:
+            crawler.commit(article)
+
+        if discovery:
+            # Only now are the listed articles safely ingested.
+            discovery.commit()
+            sleep(discovery_interval)
@@ -0,0 +1,202 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from .logger import logger
+from .metrics import registry
+from .scraper import Download, NotModifiedError, Scraper
+from .state import CrawlState
+from .utilities import is_news_article
+
+
+SECTIONS = [
+    'uk',
+    'world',
+    'business',
+    'politics',
+    'technology',
+    'science_and_environment',
+    'health',
+    'education',
+    'entertainment_and_arts'
+]
+
+SECTION_URLS = [f'https://www.bbc.co.uk/news/{i}' for i in SECTIONS]
+
+DEFAULT_FEEDS = [
+    f'https://feeds.bbci.co.uk/news/{i}/rss.xml' for i in SECTIONS
+] + [
+    'https://www.bbc.co.uk/sitemaps/https-index-uk-news.xml'
+]
+
+Entry = Tuple[str, Optional[datetime]]
+
+discovered_urls = registry.counter(
+    'rabbit_crawler_discovered_total',
+    'Article URLs found in feeds and sitemaps, by whether they were new.',
+    ['result']
+)
+
+
+def _local_name(tag: str) -> str:
+    # Feeds mix namespaces freely, so match on local names only.
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element: ElementTree.Element, *names: str) -> Optional[str]:
+    for child in element:
+        if _local_name(child.tag) in names and child.text:
+            return child.text.strip()
+
+    return None
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+
+    try:
+        # RFC-822, used by RSS.
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            # ISO-8601, used by Atom and sitemaps.
+            date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return date
+
+
+def parse_feed(content: bytes) -> Tuple[List[Entry], List[Entry]]:
+    '''
+    Read the entries of an RSS feed, Atom feed, sitemap or sitemap index.
+    Returns the pages it lists and, for a sitemap index, the sitemaps it
+    points to, each with its last modification time where known.
+    '''
+    root = ElementTree.fromstring(content)
+    kind = _local_name(root.tag)
+    pages, sitemaps = [], []
+
+    for element in root.iter():
+        name = _local_name(element.tag)
+
+        if name == 'item':
+            pages.append((
+                _child_text(element, 'link', 'guid'),
+                _parse_date(_child_text(element, 'pubDate', 'date'))
+            ))
+        elif name == 'entry':
+            link = next((
+                i.get('href') for i in element
+                if _local_name(i.tag) == 'link' and
+                i.get('rel', 'alternate') == 'alternate'
+            ), None)
+            pages.append((
+                link,
+                _parse_date(_child_text(element, 'updated', 'published'))
+            ))
+        elif name in ('url', 'sitemap') and kind in ('urlset', 'sitemapindex'):
+            lastmod = _child_text(element, 'lastmod')
+
+            if lastmod is None:
+                # Google News sitemaps carry the date in a news element.
+                for news in element.iter():
+                    if _local_name(news.tag) == 'publication_date':
+                        lastmod = news.text and news.text.strip()
+
+            entry = (_child_text(element, 'loc'), _parse_date(lastmod))
+            (sitemaps if name == 'sitemap' else pages).append(entry)
+
+    return [i for i in pages if i[0]], [i for i in sitemaps if i[0]]
+
+
+class Discovery:
+    '''
+    Finds new and updated articles from feeds and sitemaps.
+
+    A URL is returned if the crawl state has never seen it, or if its
+    feed entry was modified after it was last fetched. Feeds themselves are
+    fetched conditionally, so an unchanged feed costs a single request.
+    Their validators are held back until commit is called, once the
+    articles they listed have been ingested.
+    '''
+
+    def __init__(self: object, feeds: List[str], state: CrawlState):
+        self.feeds = feeds
+        self.state = state
+        self.pending: List[Download] = []
+
+    def _is_new(self: object, url: str, lastmod: Optional[datetime]) -> bool:
+        page = self.state.get(url)
+
+        if page is None:
+            return True
+
+        return lastmod is not None and \
+            lastmod > datetime.fromisoformat(page.last_seen)
+
+    def _read(self: object, url: str) -> Tuple[List[Entry], List[Entry]]:
+        try:
+            download = Scraper.download(url, self.state)
+            entries = parse_feed(download.content)
+            self.pending.append(download)
+            return entries
+        except NotModifiedError:
+            return [], []
+        except Exception as error:
+            logger.error(f'⚠️  Unable to read feed {url}: {error}')
+            return [], []
+
+    def _entries(self: object) -> Iterator[Entry]:
+        for feed in self.feeds:
+            pages, sitemaps = self._read(feed)
+            yield from pages
+
+            for sitemap, lastmod in sitemaps:
+                if self._is_new(sitemap, lastmod):
+                    yield from self._read(sitemap)[0]
+
+    def discover(self: object) -> List[str]:
+        '''Return the article URLs that need fetching, newest first.'''
+        latest: Dict[str, Optional[datetime]] = {}
+
+        for url, lastmod in self._entries():
+            url_parse = Scraper.format_url(url)
+            url = f'{url_parse.scheme}://{url_parse.hostname}{url_parse.path}'
+
+            if not is_news_article(url):
+                continue
+
+            # Keep the newest modification time of URLs listed repeatedly.
+            if lastmod is None:
+                latest.setdefault(url, None)
+            elif latest.get(url) is None or lastmod > latest[url]:
+                latest[url] = lastmod
+
+        urls = []
+
+        for url, lastmod in latest.items():
+            new = self._is_new(url, lastmod)
+            discovered_urls.inc(result='new' if new else 'seen')
+            if new:
+                urls.append(url)
+
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        return sorted(urls, key=lambda i: latest[i] or oldest, reverse=True)
+
+    def commit(self: object) -> None:
+        '''Record the feeds read since the last commit as seen.'''
+        for download in self.pending:
+            self.state.update(
+                download.url,
+                download.etag,
+                download.last_modified,
+                download.content_hash
+            )
+
+        self.pending = []
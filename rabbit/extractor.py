@@ -0,0 +1,117 @@
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+
+Attributes = List[Tuple[str, Optional[str]]]
+
+# Elements whose contents BeautifulSoup does not count as text.
+SKIPPED_TAGS = ('script', 'style', 'template')
+
+
+class ArticleExtractor(HTMLParser):
+    '''
+    Collects everything needed for an Article in a single streaming pass.
+
+    Only the first <h1>, the first <time datetime>, the first
+    article:section <meta> tag and the text blocks of the first <article>
+    are kept, mirroring the BeautifulSoup lookups this replaces. As there,
+    a text block nested in another is kept as well, in the order the blocks
+    open, and the contents of <script>, <style> and <template> are not text.
+    '''
+
+    def __init__(self: object):
+        super().__init__(convert_charrefs=True)
+
+        self.title: Optional[str] = None
+        self.date: Optional[str] = None
+        self.category: Optional[str] = None
+        self.content: List[str] = []
+        self.links: List[str] = []
+
+        self._title_depth = 0
+        self._title_parts: List[str] = []
+        self._article_depth = 0
+        self._article_done = False
+        self._div_depth = 0
+        # Open text blocks as (div depth, index in content, parts).
+        self._blocks: List[Tuple[int, int, List[str]]] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self: object, tag: str, attrs: Attributes) -> None:
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value is not None:
+                    self.links.append(value)
+                    break
+        elif tag == 'div':
+            self._div_depth += 1
+            if self._article_depth and \
+                    ('data-component', 'text-block') in attrs:
+                self.content.append('')
+                self._blocks.append((self._div_depth, len(self.content) - 1, []))
+        elif tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == 'h1':
+            if self._title_depth:
+                self._title_depth += 1
+            elif self.title is None:
+                self._title_depth = 1
+        elif tag == 'time':
+            if self.date is None:
+                for name, value in attrs:
+                    if name == 'datetime' and value:
+                        self.date = value
+                        break
+        elif tag == 'meta':
+            if self.category is None and \
+                    ('property', 'article:section') in attrs:
+                self.category = dict(attrs).get('content')
+        elif tag == 'article':
+            if self._article_depth:
+                self._article_depth += 1
+            elif not self._article_done:
+                self._article_depth = 1
+
+    def handle_startendtag(self: object, tag: str, attrs: Attributes) -> None:
+        # Self-closing tags never contain text, so only record their
+        # attributes without opening a capture.
+        if tag in ('a', 'time', 'meta'):
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self: object, tag: str) -> None:
+        if tag == 'div' and self._div_depth:
+            if self._blocks and self._blocks[-1][0] == self._div_depth:
+                self._close_block()
+            self._div_depth -= 1
+        elif tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == 'h1' and self._title_depth:
+            self._title_depth -= 1
+            if not self._title_depth:
+                self.title = ''.join(self._title_parts)
+        elif tag == 'article' and self._article_depth:
+            self._article_depth -= 1
+            if not self._article_depth:
+                self._article_done = True
+
+    def handle_data(self: object, data: str) -> None:
+        if self._skip_depth:
+            return
+        if self._title_depth:
+            self._title_parts.append(data)
+        for _depth, _index, parts in self._blocks:
+            parts.append(data)
+
+    def _close_block(self: object) -> None:
+        _depth, index, parts = self._blocks.pop()
+        self.content[index] = ''.join(parts)
+
+    def close(self: object) -> None:
+        super().close()
+
+        # Unclosed elements still count, as they would in a parsed tree.
+        if self._title_depth:
+            self.title = ''.join(self._title_parts)
+            self._title_depth = 0
+        while self._blocks:
+            self._close_block()
@@ -0,0 +1,91 @@
+import math
+import sys
+from hashlib import blake2b
+from typing import Iterator, Union
+
+
+def url_key(url: str) -> bytes:
+    '''A compact, fixed size key standing in for a canonical URL.'''
+    return blake2b(url.encode(), digest_size=8).digest()
+
+
+class QueueItem:
+    __slots__ = ('url', 'depth')
+
+    def __init__(self: object, url: str, depth: int):
+        self.url = sys.intern(url)
+        self.depth = depth
+
+    def __iter__(self: object) -> Iterator[Union[str, int]]:
+        yield self.url
+        yield self.depth
+
+    def __repr__(self: object) -> str:
+        return f'QueueItem({self.url!r}, {self.depth})'
+
+
+class VisitedSet:
+    '''Exact set of visited URLs, storing 8 byte digests instead of strings.'''
+
+    def __init__(self: object):
+        self.keys = set()
+
+    def __contains__(self: object, url: str) -> bool:
+        return url_key(url) in self.keys
+
+    def __len__(self: object) -> int:
+        return len(self.keys)
+
+    def add(self: object, url: str) -> bool:
+        '''Add a URL, returning False if it was already present.'''
+        key = url_key(url)
+
+        if key in self.keys:
+            return False
+
+        self.keys.add(key)
+        return True
+
+
+class BloomFilter:
+    '''
+    Probabilistic set of visited URLs with a fixed memory footprint.
+
+    Sized for capacity URLs at the given false positive rate. A false
+    positive makes the crawler skip a URL it has not actually visited.
+    '''
+
+    def __init__(self: object, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self: object, url: str) -> Iterator[int]:
+        digest = blake2b(url.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def __contains__(self: object, url: str) -> bool:
+        return all(
+            self.bits[i >> 3] & (1 << (i & 7))
+            for i in self._positions(url)
+        )
+
+    def __len__(self: object) -> int:
+        return self.count
+
+    def add(self: object, url: str) -> bool:
+        '''Add a URL, returning False if it was (probably) already present.'''
+        added = False
+
+        for i in self._positions(url):
+            if not self.bits[i >> 3] & (1 << (i & 7)):
+                self.bits[i >> 3] |= 1 << (i & 7)
+                added = True
+
+        self.count += added
+        return added
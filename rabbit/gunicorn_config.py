@@ -0,0 +1,14 @@
+'''
+Gunicorn settings for the web API, loaded with -c python:rabbit.gunicorn_config.
+Only the metrics module is imported, so that the master process does not
+load the app before forking its workers.
+'''
+import os
+
+from .metrics import clear_metrics
+
+
+def on_starting(_server) -> None:
+    # Counters of workers from a previous run would otherwise be summed in.
+    if os.environ.get('RABBIT_METRICS_DIR'):
+        clear_metrics(os.environ['RABBIT_METRICS_DIR'])
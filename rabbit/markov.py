@@ -0,0 +1,192 @@
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from hashlib import md5
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import markovify
+import requests
+from urllib3.util import make_headers
+
+from .logger import logger
+
+
+ChainModel = Dict[Tuple[str, ...], Dict[str, int]]
+
+
+def _add_chain(total: ChainModel, model: ChainModel, weight: int) -> None:
+    for state, options in model.items():
+        current = total.setdefault(state, {})
+
+        for word, count in options.items():
+            current[word] = current.get(word, 0) + count * weight
+
+            # Removing a day leaves transitions no other day has seen.
+            if not current[word]:
+                del current[word]
+
+        if not current:
+            del total[state]
+
+
+class CombinedModel:
+    '''
+    A running sum of the chains of several daily models.
+
+    Days are added and removed individually, so a sliding scope only
+    touches the days entering and leaving it rather than combining every
+    day again.
+    '''
+
+    def __init__(self: object):
+        self.days: Dict[date, Optional[markovify.Text]] = {}
+        self.chain: ChainModel = {}
+
+    def add(self: object, day: date, model: Optional[markovify.Text]) -> None:
+        self.days[day] = model
+        if model:
+            _add_chain(self.chain, model.chain.model, 1)
+
+    def remove(self: object, day: date) -> None:
+        model = self.days.pop(day)
+        if model:
+            _add_chain(self.chain, model.chain.model, -1)
+
+    def build(self: object, extra: List[markovify.Text]) -> Optional[markovify.Text]:
+        '''Compile the sum together with models that are not part of it.'''
+        models = [i for i in self.days.values() if i] + extra
+
+        if not models:
+            return None
+
+        chain = {state: dict(options) for state, options in self.chain.items()}
+        for model in extra:
+            _add_chain(chain, model.chain.model, 1)
+
+        return markovify.Text.from_chain(chain, parsed_sentences=[
+            sentence for model in models for sentence in model.parsed_sentences
+        ]).compile(inplace=True)
+
+
+class DailyModelCache:
+    '''
+    Markov models trained on a single day of text.
+
+    Each day is fetched and trained once and then kept in memory and on
+    disk using markovify's JSON export. Days within refresh_days of today
+    are still receiving articles, so they are fetched again, conditionally,
+    and only retrained when their text changed.
+    '''
+
+    def __init__(
+        self: object,
+        directory: str,
+        text_endpoint: str,
+        refresh_days: int = 2
+    ):
+        self.directory = directory
+        self.text_endpoint = text_endpoint
+        self.refresh_days = refresh_days
+        self.models: Dict[date, Optional[markovify.Text]] = {}
+        # Incomplete days by ETag and text hash, and their current model.
+        self.recent: Dict[date, Tuple[Optional[str], str, Optional[markovify.Text]]] = {}
+        # Sums of the complete days of each scope combined so far.
+        self.combined: Dict[Hashable, CombinedModel] = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self: object, day: date) -> str:
+        return os.path.join(self.directory, f'{day.isoformat()}.json')
+
+    def _is_complete(self: object, day: date) -> bool:
+        return day <= datetime.utcnow().date() - timedelta(days=self.refresh_days)
+
+    def _fetch(self: object, day: date, etag: Optional[str] = None) -> requests.Response:
+        # Ask for every encoding urllib3 can decode, including brotli when
+        # it is installed. requests decompresses the body transparently.
+        headers = make_headers(accept_encoding=True)
+        if etag:
+            headers['If-None-Match'] = etag
+
+        response = requests.get(self.text_endpoint, params={
+            'from': datetime.combine(day, time.min).isoformat(),
+            'until': datetime.combine(day, time.max).isoformat()
+        }, headers=headers, timeout=15)
+        response.raise_for_status()
+        return response
+
+    def _load(self: object, day: date) -> Optional[markovify.Text]:
+        with open(self._path(day)) as file:
+            model_json = json.load(file)
+
+        return model_json and markovify.Text.from_dict(model_json)
+
+    def _save(self: object, day: date, model: Optional[markovify.Text]) -> None:
+        path = self._path(day)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(temporary_path, 'w') as file:
+            json.dump(model and model.to_dict(), file)
+
+        os.replace(temporary_path, path)
+
+    def get(self: object, day: date) -> Optional[markovify.Text]:
+        '''Return the model for a day, or None if it had no text.'''
+        complete = self._is_complete(day)
+
+        if complete and day in self.models:
+            return self.models[day]
+
+        if complete and os.path.exists(self._path(day)):
+            self.models[day] = self._load(day)
+            return self.models[day]
+
+        etag, text_hash, model = self.recent.pop(day, (None, None, None))
+        response = self._fetch(day, etag)
+
+        if response.status_code != 304:
+            etag = response.headers.get('ETag')
+            text = response.text
+            previous_hash, text_hash = text_hash, md5(text.encode()).hexdigest()
+
+            if text_hash != previous_hash:
+                logger.info(f'Training markov chain for {day.isoformat()}.')
+                model = markovify.Text(text) if text else None
+
+        if complete:
+            self._save(day, model)
+            self.models[day] = model
+        else:
+            self.recent[day] = (etag, text_hash, model)
+
+        return model
+
+    def combine(
+        self: object,
+        days: List[date],
+        key: Hashable = None
+    ) -> Optional[markovify.Text]:
+        '''
+        Combine the models for the given days into one compiled model. The
+        complete days are kept summed under key, so that only the days that
+        changed since the last call for the same key are combined again.
+        '''
+        combined = self.combined.setdefault(key, CombinedModel())
+        complete = [i for i in days if self._is_complete(i)]
+        refresh = [i for i in days if i not in complete]
+
+        for day in [i for i in combined.days if i not in complete]:
+            combined.remove(day)
+
+        for day in complete:
+            if day not in combined.days:
+                combined.add(day, self.get(day))
+
+        return combined.build([i for i in map(self.get, refresh) if i])
+
+    def evict(self: object, oldest: date) -> None:
+        '''Forget in-memory models for days before oldest.'''
+        for day in [i for i in self.models if i < oldest]:
+            del self.models[day]
+        for day in [i for i in self.recent if i < oldest]:
+            del self.recent[day]
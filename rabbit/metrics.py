@@ -0,0 +1,308 @@
+import json
+import os
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, List, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self: object, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = Lock()
+
+    def _key(self: object, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(i, '')) for i in self.labels)
+
+    def _format_labels(self: object, key: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def empty(self: object) -> 'Metric':
+        '''Return a metric with the same definition and no values.'''
+        return type(self)(self.name, self.description, self.labels)
+
+    def dump(self: object) -> list:
+        '''Return the values in a JSON serialisable form.'''
+        raise NotImplementedError
+
+    def merge(self: object, values: list) -> None:
+        '''Add values dumped by the same metric in another process.'''
+        raise NotImplementedError
+
+    def samples(self: object) -> List[str]:
+        raise NotImplementedError
+
+    def render(self: object) -> str:
+        return '\n'.join([
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+            *self.samples()
+        ])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self: object, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self: object, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dump(self: object) -> list:
+        with self.lock:
+            return [[list(k), v] for k, v in self.values.items()]
+
+    def merge(self: object, values: list) -> None:
+        # Gauges of running processes are summed as well, which suits
+        # per-process totals.
+        for key, value in values:
+            self.inc(value, **dict(zip(self.labels, key)))
+
+    def samples(self: object) -> List[str]:
+        with self.lock:
+            return [
+                f'{self.name}{self._format_labels(k)} {v}'
+                for k, v in self.values.items()
+            ]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self: object, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self: object,
+        *args,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def empty(self: object) -> 'Histogram':
+        return Histogram(
+            self.name,
+            self.description,
+            self.labels,
+            buckets=self.buckets
+        )
+
+    def observe(self: object, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = counts, total + value
+
+    def dump(self: object) -> list:
+        with self.lock:
+            return [[list(k), list(c), t] for k, (c, t) in self.values.items()]
+
+    def merge(self: object, values: list) -> None:
+        with self.lock:
+            for key, counts, total in values:
+                key = tuple(key)
+                current, current_total = self.values.get(
+                    key,
+                    ([0] * (len(self.buckets) + 1), 0.0)
+                )
+                self.values[key] = (
+                    [a + b for a, b in zip(current, counts)],
+                    current_total + total
+                )
+
+    def samples(self: object) -> List[str]:
+        lines = []
+
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    labels = self._format_labels(key, 'le="' + le + '"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                lines.append(f'{self.name}_sum{self._format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+
+        return lines
+
+
+class Registry:
+    def __init__(self: object):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def _register(self: object, metric_type: type, name: str, *args, **kwargs) -> Metric:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_type(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self: object, name: str, *args, **kwargs) -> Counter:
+        return self._register(Counter, name, *args, **kwargs)
+
+    def gauge(self: object, name: str, *args, **kwargs) -> Gauge:
+        return self._register(Gauge, name, *args, **kwargs)
+
+    def histogram(self: object, name: str, *args, **kwargs) -> Histogram:
+        return self._register(Histogram, name, *args, **kwargs)
+
+    def render(self: object) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(i.render() for i in metrics) + '\n'
+
+    def dump(self: object) -> Dict[str, list]:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {i.name: i.dump() for i in metrics}
+
+    def merged(self: object, dumps: List[Dict[str, list]]) -> 'Registry':
+        '''
+        Return a registry of the same metrics holding the sum of the given
+        dumps. Metrics unknown to this registry are ignored.
+        '''
+        combined = Registry()
+
+        with self.lock:
+            combined.metrics = {k: v.empty() for k, v in self.metrics.items()}
+
+        for dump in dumps:
+            for name, values in dump.items():
+                if name in combined.metrics:
+                    combined.metrics[name].merge(values)
+
+        return combined
+
+
+# Metrics are per process. Each poem builder scope process serves its own,
+# while gunicorn workers share theirs through a directory, see below.
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self: object):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self: object, *args) -> None:
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    '''Serve the registry at /metrics on a background thread.'''
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_metrics(directory: str) -> None:
+    '''Write this process's metrics to its own file in directory.'''
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    temporary_path = f'{path}.tmp'
+
+    with open(temporary_path, 'w') as file:
+        json.dump(registry.dump(), file)
+
+    os.replace(temporary_path, path)
+
+
+def start_metrics_writer(directory: str, interval: float) -> Thread:
+    '''Write this process's metrics to directory every interval seconds.'''
+    os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            write_metrics(directory)
+            sleep(interval)
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def read_metrics(directory: str) -> Registry:
+    '''
+    Sum the metrics written to directory by every process. Counters and
+    histograms of processes that have since exited are kept, so that they
+    never go backwards, but their gauges no longer describe anything.
+    '''
+    dumps = []
+
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+
+        with open(os.path.join(directory, name)) as file:
+            dump = json.load(file)
+
+        if not _is_running(int(name[:-len('.json')])):
+            dump = {
+                k: v for k, v in dump.items()
+                if not isinstance(registry.metrics.get(k), Gauge)
+            }
+
+        dumps.append(dump)
+
+    return registry.merged(dumps)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to someone else.
+        return True
+
+    return True
+
+
+def clear_metrics(directory: str) -> None:
+    '''Remove the metrics of a previous run, before any process writes.'''
+    os.makedirs(directory, exist_ok=True)
+
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -1,97 +1,206 @@
-import json
-import os
-from datetime import datetime, timedelta, timezone
-from time import sleep
-from typing import Dict
-
-import markovify
-import requests 
-from requests.exceptions import HTTPError
-
-from .logger import logger
-from .web.poem import Poem, PoemType
-
-
-class Scope:
-    def __init__(self: object, fr: datetime, un: datetime):
-        self.fr = fr
-        self.un = un
-
-
-format_date = lambda i: i.strftime('%Y-%m-%d')
-
-
-def build_poems(scope_map: Dict[PoemType, Scope], poem_type: PoemType):
-    scope = scope_map[poem_type]
-    
-    logger.info(f'Fetching text blob for "{poem_type.value}" scope.')
-    
-    response = requests.get(rabbit_text_endpoint, params={
-        'from': format_date(scope.fr),
-        'until': format_date(scope.un)
-    }, timeout=15)
-    
-    try:
-        response.raise_for_status()
-    except HTTPError as e:
-        logger.warning(e)
-        return
-    
-    if not response.text:
-        logger.warning(f'Text blob empty for "{poem_type.value}", skipping.')
-        return
-    
-    logger.info(f'Generating markov chain with "{poem_type.value}" scope.')
-    
-    text_model = markovify.Text(response.text)
-    
-    for i in range(10):
-        poem = Poem(
-            [text_model.make_sentence() for _ in range(5)],
-            datetime.utcnow().replace(tzinfo=timezone.utc)
-        )
-        logger.debug(json.dumps(poem.json(), indent=2))
-    
-        response = requests.post(rabbit_poem_endpoint, json=poem.json(),
-            headers={
-                'X-Api-Key': rabbit_api_key
-            },
-            params={
-                'scope': poem_type.value
-            },
-            timeout=15
-        )
-    
-        try:
-            response.raise_for_status()
-        except HTTPError as e:
-            logger.warning(e)
-
-
-if __name__ == '__main__':
-    rabbit_api_key = os.environ['RABBIT_API_KEY']
-    rabbit_poem_endpoint = os.environ['RABBIT_POEM_ENDPOINT']
-    rabbit_text_endpoint = os.environ['RABBIT_TEXT_ENDPOINT']
-
-    while True:
-        current_time = datetime.utcnow()
-    
-        scope_map = {
-            PoemType.Day: Scope(
-                current_time - timedelta(days=1),
-                current_time
-            ),
-            PoemType.Month: Scope(
-                current_time - timedelta(days=30),
-                current_time
-            ),
-            PoemType.Year: Scope(
-                current_time - timedelta(days=365),
-                current_time
-            )
-        }
-    
-        for poem_type in PoemType:
-            build_poems(scope_map, poem_type)
-
-        sleep(60 * 60)
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+from multiprocessing import Process
+from multiprocessing.connection import wait
+from time import monotonic, sleep
+from typing import Dict, List, Optional
+
+import markovify
+import requests 
+from redis.exceptions import RedisError
+from requests.exceptions import HTTPError
+
+from .logger import logger
+from .markov import DailyModelCache
+from .metrics import registry, start_metrics_server
+from .web.poem import Poem, PoemManager, PoemType
+
+
+training_seconds = registry.histogram(
+    'rabbit_poem_training_seconds',
+    'Time taken to fetch, train and combine the model for a scope.',
+    ['scope'],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+model_states = registry.gauge(
+    'rabbit_poem_model_states',
+    'Number of states in the chain of the latest model for a scope.',
+    ['scope']
+)
+published_poems = registry.counter(
+    'rabbit_poem_published_total',
+    'Poems published to the web API, by scope.',
+    ['scope']
+)
+
+
+class Scope:
+    def __init__(self: object, fr: datetime, un: datetime):
+        self.fr = fr
+        self.un = un
+
+    def days(self: object) -> List[date]:
+        return [
+            self.fr.date() + timedelta(days=i)
+            for i in range((self.un.date() - self.fr.date()).days + 1)
+        ]
+
+
+def get_scope_map(current_time: datetime) -> Dict[PoemType, Scope]:
+    return {
+        PoemType.Day: Scope(
+            current_time - timedelta(days=1),
+            current_time
+        ),
+        PoemType.Month: Scope(
+            current_time - timedelta(days=30),
+            current_time
+        ),
+        PoemType.Year: Scope(
+            current_time - timedelta(days=365),
+            current_time
+        )
+    }
+
+
+def train_model(
+    scope_map: Dict[PoemType, Scope],
+    poem_type: PoemType,
+    model_cache: DailyModelCache
+) -> Optional[markovify.Text]:
+    scope = scope_map[poem_type]
+    
+    logger.info(f'Generating markov chain with "{poem_type.value}" scope.')
+    
+    start = monotonic()
+
+    try:
+        text_model = model_cache.combine(scope.days(), poem_type)
+    except HTTPError as e:
+        logger.warning(e)
+        return None
+
+    training_seconds.observe(monotonic() - start, scope=poem_type.value)
+    
+    if not text_model:
+        logger.warning(f'Text blob empty for "{poem_type.value}", skipping.')
+        return None
+
+    model_states.set(len(text_model.chain.model), scope=poem_type.value)
+
+    return text_model
+
+
+def publish_poems(
+    poem_type: PoemType,
+    text_model: markovify.Text,
+    count: int = 10
+):
+    poems = []
+
+    for i in range(count):
+        poem = Poem(
+            [text_model.make_sentence() for _ in range(5)],
+            datetime.utcnow().replace(tzinfo=timezone.utc)
+        )
+        logger.debug(json.dumps(poem.json(), indent=2))
+        poems.append(poem)
+    
+    response = requests.post(
+        os.environ['RABBIT_POEMS_ENDPOINT'],
+        json=[i.json() for i in poems],
+        headers={
+            'X-Api-Key': os.environ['RABBIT_API_KEY']
+        },
+        params={
+            'scope': poem_type.value
+        },
+        timeout=15
+    )
+    
+    try:
+        response.raise_for_status()
+    except HTTPError as e:
+        logger.warning(e)
+        return
+
+    published_poems.inc(count, scope=poem_type.value)
+
+
+def build_poems(
+    scope_map: Dict[PoemType, Scope],
+    poem_type: PoemType,
+    model_cache: DailyModelCache
+):
+    text_model = train_model(scope_map, poem_type, model_cache)
+
+    if text_model:
+        publish_poems(poem_type, text_model)
+
+
+def run_scope(poem_type: PoemType, metrics_port: int):
+    '''
+    Retrain the model for one scope once an hour and keep it in memory in
+    between, publishing a batch of poems after each retrain and whenever
+    readers run low.
+    '''
+    start_metrics_server(metrics_port)
+
+    model_cache = DailyModelCache(
+        os.environ.get('RABBIT_MODEL_DIR', 'models'),
+        os.environ['RABBIT_TEXT_ENDPOINT']
+    )
+    poem_manager = PoemManager()
+    batch_size = int(os.environ.get('RABBIT_POEM_BATCH_SIZE', 10))
+    retrain_seconds = int(os.environ.get('RABBIT_POEM_RETRAIN_SECONDS', 60 * 60))
+    text_model, trained = None, None
+
+    while True:
+        if trained is None or monotonic() - trained >= retrain_seconds:
+            scope_map = get_scope_map(datetime.utcnow())
+            previous_model = text_model
+
+            # Keep serving from the previous model if retraining fails.
+            text_model = train_model(scope_map, poem_type, model_cache) \
+                or previous_model
+            model_cache.evict(scope_map[poem_type].fr.date())
+
+            if text_model:
+                # Readers have something before the first refill, and ring
+                # buffers, which only run low while filling, still turn over.
+                publish_poems(poem_type, text_model, batch_size)
+
+            trained = monotonic()
+
+        try:
+            refill = poem_manager.wait_for_refill(poem_type, 1)
+        except RedisError as e:
+            logger.warning(e)
+            sleep(5)
+            continue
+
+        if refill and text_model:
+            publish_poems(poem_type, text_model, batch_size)
+
+
+if __name__ == '__main__':
+    # Each scope trains in its own process so that a full refresh takes as
+    # long as the slowest scope rather than the sum of all of them.
+    # Every scope process serves its own metrics, on consecutive ports.
+    metrics_port = int(os.environ.get('RABBIT_METRICS_PORT', 9100))
+    processes = [
+        Process(target=run_scope, args=(poem_type, metrics_port + i))
+        for i, poem_type in enumerate(PoemType)
+    ]
+
+    for process in processes:
+        process.start()
+
+    wait([i.sentinel for i in processes])
+
+    for process in processes:
+        process.terminate()
+
+    sys.exit(1)
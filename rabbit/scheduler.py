@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+from time import monotonic
+from typing import Dict, Optional
+
+
+class HostScheduler:
+    '''
+    Politeness scheduler for a single host.
+
+    Requests must call acquire() before being sent and release() once a
+    response (or error) is back. A token bucket caps the request rate, while
+    the number of concurrent requests grows additively on healthy responses
+    and is halved on 429/5xx responses, errors and latency spikes.
+    '''
+
+    def __init__(
+        self: object,
+        rate: float = 10.0,
+        burst: int = 10,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        latency_spike: float = 3.0
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_spike = latency_spike
+
+        self.condition = Condition()
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.concurrency = float(min(4, max_concurrency))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.average_latency = None
+
+    def _refill(self: object, now: float) -> None:
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self: object) -> None:
+        with self.condition:
+            while True:
+                now = monotonic()
+                self._refill(now)
+
+                if now < self.blocked_until:
+                    timeout = self.blocked_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    timeout = None
+                elif self.tokens < 1:
+                    timeout = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+
+                self.condition.wait(timeout)
+
+    def release(
+        self: object,
+        status: Optional[int],
+        latency: float,
+        retry_after: Optional[float] = None
+    ) -> None:
+        with self.condition:
+            self.in_flight -= 1
+
+            if retry_after:
+                self.blocked_until = max(
+                    self.blocked_until,
+                    monotonic() + retry_after
+                )
+
+            spike = self.average_latency is not None and \
+                latency > self.average_latency * self.latency_spike
+
+            if status is None or status == 429 or status >= 500 or spike:
+                self.concurrency = max(
+                    self.min_concurrency,
+                    self.concurrency / 2
+                )
+            else:
+                self.concurrency = min(
+                    self.max_concurrency,
+                    self.concurrency + 1 / self.concurrency
+                )
+
+            if self.average_latency is None:
+                self.average_latency = latency
+            else:
+                self.average_latency += (latency - self.average_latency) * 0.2
+
+            self.condition.notify_all()
+
+
+class Scheduler:
+    '''Hands out one HostScheduler per hostname.'''
+
+    def __init__(self: object, **host_options):
+        self.host_options = host_options
+        self.hosts: Dict[str, HostScheduler] = {}
+        self.lock = Lock()
+
+    def get(self: object, hostname: str) -> HostScheduler:
+        with self.lock:
+            if hostname not in self.hosts:
+                self.hosts[hostname] = HostScheduler(**self.host_options)
+            return self.hosts[hostname]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -1,20 +1,54 @@
+from collections import namedtuple
 from email.utils import parsedate_to_datetime
-from typing import List, Optional
+from functools import lru_cache
+from hashlib import md5
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import ParseResult, urlparse
 
-import bs4
 import requests
 from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 from retry import retry
 
+from .extractor import ArticleExtractor
 from .logger import logger
-from .utilities import is_news_article
+from .metrics import registry
+from .scheduler import Scheduler, parse_retry_after
+from .state import CrawlState
+from .utilities import is_news_path
+
+
+fetch_seconds = registry.histogram(
+    'rabbit_crawler_fetch_seconds',
+    'Time taken to fetch a page, by response status.',
+    ['status']
+)
+fetch_retries = registry.counter(
+    'rabbit_crawler_fetch_retries_total',
+    'Failed fetch attempts, each of which is retried until tries run out.',
+    ['reason']
+)
+
+
+Download = namedtuple('Download', [
+    'url',
+    'content',
+    'etag',
+    'last_modified',
+    'content_hash'
+])
 
 
 class ScraperError(Exception):
     pass
 
 
+class NotModifiedError(ScraperError):
+    pass
+
+
 class Scraper:
     date_formats = [
         r'%Y-%m-%dT%H:%M:%S.%fZ',
@@ -22,6 +56,21 @@ class Scraper:
         r'%Y-%m-%dT%H:%M:%SZ'
     ]
 
+    scheduler = Scheduler()
+    sessions: Dict[str, requests.Session] = {}
+    sessions_lock = Lock()
+
+    @staticmethod
+    def get_session(hostname: str) -> requests.Session:
+        with Scraper.sessions_lock:
+            if hostname not in Scraper.sessions:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                Scraper.sessions[hostname] = session
+            return Scraper.sessions[hostname]
+
     @staticmethod
     def format_url(url: str) -> ParseResult:
         url_parse = urlparse(url)
@@ -45,41 +94,110 @@ class Scraper:
 
     @staticmethod
     @retry(exceptions=requests.RequestException, tries=10, delay=1, backoff=2)
-    def fetch(url: str) -> requests.Response:
-        return requests.get(url, timeout=5)
+    def fetch(url: str, headers: Dict[str, str] = None) -> requests.Response:
+        hostname = urlparse(url).hostname
+        host_scheduler = Scraper.scheduler.get(hostname)
+        status = retry_after = None
 
-    def __init__(self: object, url: str):
-        result = Scraper.fetch(url)
-        result.encoding = 'utf-8'
+        host_scheduler.acquire()
+        start = monotonic()
 
-        self.soup = bs4.BeautifulSoup(result.text, 'html.parser')
-        self.url = Scraper.format_url(url)
+        try:
+            response = Scraper.get_session(hostname).get(
+                url,
+                headers=headers,
+                timeout=5
+            )
+            status = response.status_code
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except requests.RequestException as error:
+            fetch_retries.inc(reason=type(error).__name__)
+            raise
+        finally:
+            latency = monotonic() - start
+            host_scheduler.release(status, latency, retry_after)
+            fetch_seconds.observe(latency, status=status or 'error')
+
+        if status == 429 or status >= 500:
+            fetch_retries.inc(reason=status)
+            raise requests.HTTPError(
+                f'{status} response from {hostname}.',
+                response=response
+            )
+
+        return response
 
-    def _format_href(self: object, href: str) -> str:
-        if href.startswith('/'):
-            href = f'{self.url.scheme}://{self.url.hostname}{href}'
-    
-        url = Scraper.format_url(href)
+    @staticmethod
+    def download(url: str, state: Optional[CrawlState] = None) -> Download:
+        '''
+        Fetch the raw body of a page, raising if it has not changed. The
+        crawl state is only read, so that callers can record the download
+        once they are done with it.
+        '''
+        headers = state.conditional_headers(url) if state else None
+        result = Scraper.fetch(url, headers)
+        download = Download(
+            url,
+            result.content,
+            result.headers.get('ETag'),
+            result.headers.get('Last-Modified'),
+            md5(result.content).hexdigest()[:16]
+        )
+
+        if state:
+            Scraper._check_modified(result.status_code, download, state)
+
+        return download
+
+    def __init__(
+        self: object,
+        url: str,
+        state: Optional[CrawlState] = None,
+        content: Optional[bytes] = None
+    ):
+        # Pages that were downloaded elsewhere can be passed in as content.
+        if content is None:
+            content = Scraper.download(url, state).content
+
+        self.extractor = ArticleExtractor()
+        self.extractor.feed(content.decode('utf-8', errors='replace'))
+        self.extractor.close()
+        self.url = Scraper.format_url(url)
 
-        return f'{url.scheme}://{url.hostname}{url.path}'
+    @staticmethod
+    def _check_modified(
+        status_code: int,
+        download: Download,
+        state: CrawlState
+    ) -> None:
+        if status_code == 304:
+            state.touch(download.url)
+            raise NotModifiedError('Page not modified.')
+
+        previous = state.get(download.url)
+
+        # Not every response carries validators, so fall back to comparing
+        # the body against what was downloaded last time.
+        if previous and previous.content_hash == download.content_hash:
+            state.touch(download.url)
+            raise NotModifiedError('Page content unchanged.')
+
+    def _format_href(self: object, href: str) -> Tuple[str, Optional[str], str]:
+        return _format_href(href, self.url.scheme, self.url.hostname)
 
     def get_title(self: object) -> str:
-        header_element = self.soup.h1
-
-        if not header_element:
+        if self.extractor.title is None:
             raise ScraperError('Header missing from page.')
 
-        return header_element.text
+        return self.extractor.title
 
 
     def get_date(self: object) -> datetime:
-        date_element = self.soup.find('time', {'datetime': True})
+        date_string = self.extractor.date
 
-        if not date_element:
+        if not date_string:
             raise ScraperError(f'Date missing from page.')
 
-        date_string = date_element['datetime']
-
         for date_format in self.date_formats:
             try:
                 return datetime.strptime(date_string, date_format)\
@@ -101,29 +219,49 @@ class Scraper:
         raise ScraperError(f'Unrecognized date format "{date_string}".')
 
     def get_links(self: object) -> List[str]:
-        href_elements = self.soup.find_all('a', {'href': True})
-        return list(map(lambda i: self._format_href(i['href']), href_elements))
+        return [self._format_href(i)[0] for i in self.extractor.links]
 
     def get_related(self: object) -> List[str]:
-        related_news = lambda i: is_news_article(i) and \
-            urlparse(i).hostname == self.url.hostname 
+        related = []
 
-        return list(filter(related_news, self.get_links()))
+        for href in self.extractor.links:
+            url, hostname, path = self._format_href(href)
 
-    def get_content(self: object) -> List[str]:
-        if not self.soup.article:
-            return []
+            if hostname == self.url.hostname and is_news_path(path):
+                related.append(url)
 
-        paragraphs = self.soup.article.find_all('div', {
-            'data-component': 'text-block'
-        })
+        return related
 
-        return [i.text for i in paragraphs]
+    def get_content(self: object) -> List[str]:
+        return self.extractor.content
 
     def get_category(self: object) -> str:
-        meta_tag = self.soup.find('meta', {'property': 'article:section'})
-
-        if not meta_tag:
+        if self.extractor.category is None:
             raise ScraperError('Meta tag missing from page.')
 
-        return meta_tag.attrs['content']
+        return self.extractor.category
+
+
+@lru_cache(maxsize=65536)
+def _format_href(
+    href: str,
+    scheme: str,
+    hostname: str
+) -> Tuple[str, Optional[str], str]:
+    # Equivalent to Scraper.format_url, but parses the link only once.
+    if href.startswith('/'):
+        href = f'{scheme}://{hostname}{href}'
+
+    url_parse = urlparse(href)
+
+    scheme = 'https' if url_parse.scheme == 'http' else url_parse.scheme
+    hostname = url_parse.hostname
+    path = url_parse.path
+
+    if hostname == 'www.bbc.com':
+        hostname = 'www.bbc.co.uk'
+
+    if path.endswith('/'):
+        path = path[:-1]
+
+    return f'{scheme}://{hostname}{path}', hostname, path
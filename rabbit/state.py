@@ -0,0 +1,149 @@
+import sqlite3
+from collections import namedtuple
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Optional, Sequence
+
+
+PageState = namedtuple('PageState', [
+    'url',
+    'etag',
+    'last_modified',
+    'content_hash',
+    'last_seen',
+    'related'
+])
+
+
+class CrawlState:
+    '''Per-URL crawl state that survives between passes and restarts.'''
+
+    def __init__(self: object, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS page ('
+                'url TEXT PRIMARY KEY, '
+                'etag TEXT, '
+                'last_modified TEXT, '
+                'content_hash TEXT, '
+                'last_seen TEXT NOT NULL, '
+                'related TEXT)'
+            )
+
+            # Databases created before related links were recorded.
+            columns = [
+                i[1] for i in self.connection.execute('PRAGMA table_info(page)')
+            ]
+            if 'related' not in columns:
+                self.connection.execute('ALTER TABLE page ADD COLUMN related TEXT')
+
+    def get(self: object, url: str) -> Optional[PageState]:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT url, etag, last_modified, content_hash, last_seen, '
+                'related FROM page WHERE url = ?',
+                (url,)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        return PageState(*row[:-1], tuple(row[-1].split()) if row[-1] else ())
+
+    def conditional_headers(self: object, url: str) -> Dict[str, str]:
+        page = self.get(url)
+        headers = {}
+
+        if page and page.etag:
+            headers['If-None-Match'] = page.etag
+        if page and page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+
+        return headers
+
+    def update(
+        self: object,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        content_hash: str,
+        related: Sequence[str] = ()
+    ) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO page '
+                '(url, etag, last_modified, content_hash, last_seen, related) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, content_hash, _now(), '\n'.join(related))
+            )
+
+    def touch(self: object, url: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE page SET last_seen = ? WHERE url = ?',
+                (_now(), url)
+            )
+
+
+class IngestCache:
+    '''
+    Size-bounded record of the content hash last uploaded for each URL.
+
+    Articles whose hash matches the cached value have already been ingested
+    and do not need to be sent to the web API again. The least recently
+    used entries are evicted once the cache grows past max_entries.
+    '''
+
+    def __init__(self: object, path: str, max_entries: int = 100000):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+        self.max_entries = max_entries
+
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS ingest ('
+                'url TEXT PRIMARY KEY, '
+                'content_hash TEXT NOT NULL, '
+                'last_used TEXT NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS ingest_last_used '
+                'ON ingest (last_used)'
+            )
+
+    def is_current(self: object, url: str, content_hash: str) -> bool:
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'UPDATE ingest SET last_used = ? '
+                'WHERE url = ? AND content_hash = ?',
+                (_now(), url, content_hash)
+            )
+            return cursor.rowcount > 0
+
+    def update(self: object, url: str, content_hash: str) -> None:
+        self.warm({url: content_hash})
+
+    def warm(self: object, hashes: Dict[str, str]) -> None:
+        now = _now()
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO ingest '
+                '(url, content_hash, last_used) VALUES (?, ?, ?)',
+                [(url, content_hash, now) for url, content_hash in hashes.items()]
+            )
+            self.connection.execute(
+                'DELETE FROM ingest WHERE url IN ('
+                'SELECT url FROM ingest ORDER BY last_used DESC '
+                'LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+
+def _now() -> str:
+    return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
@@ -2,5 +2,12 @@ import re
 from urllib.parse import urlparse
 
 
+news_path = re.compile(r'^/news/.+')
+
+
 def is_news_article(url: str) -> bool:
-    return bool(re.match(r'^/news/.+', urlparse(url).path))
\ No newline at end of file
+    return is_news_path(urlparse(url).path)
+
+
+def is_news_path(path: str) -> bool:
+    return bool(news_path.match(path))
\ No newline at end of file
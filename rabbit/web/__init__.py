@@ -1,29 +1,39 @@
-from flask import Flask, render_template
-
-from os import environ
-
-from .api import initialise_api
-from .storage import initialise_storage
-
-
-app = Flask(
-    __name__,
-    static_folder='./build',
-    static_url_path='/rabbit'
-)
-
-app.config['RESTX_VALIDATE'] = True
-app.config['SQLALCHEMY_DATABASE_URI'] = environ.get('RABBIT_DATABASE_URI', 'sqlite:///')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-initialise_api(app)
-initialise_storage(app)
-
-
-@app.errorhandler(404)
-def index(_error):
-    return app.send_static_file('index.html')
-
-
-if __name__ == '__main__':
-    app.run()
+from flask import Flask, render_template
+
+from os import environ
+
+from .api import initialise_api
+from .compression import initialise_compression
+from .metrics import initialise_metrics
+from .storage import initialise_storage
+
+
+app = Flask(
+    __name__,
+    static_folder='./build',
+    static_url_path='/rabbit'
+)
+
+app.config['RESTX_VALIDATE'] = True
+app.config['SQLALCHEMY_DATABASE_URI'] = environ.get('RABBIT_DATABASE_URI', 'sqlite:///')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['COMPRESSION_LEVEL'] = int(environ.get('RABBIT_COMPRESSION_LEVEL', 6))
+app.config['COMPRESSION_MIN_SIZE'] = int(environ.get('RABBIT_COMPRESSION_MIN_SIZE', 1024))
+app.config['COMPRESSION_MIMETYPES'] = environ.get(
+    'RABBIT_COMPRESSION_MIMETYPES',
+    'application/json,application/javascript,text/css,text/html,text/plain'
+).split(',')
+
+initialise_metrics(app)
+initialise_compression(app)
+initialise_api(app)
+initialise_storage(app)
+
+
+@app.errorhandler(404)
+def index(_error):
+    return app.send_static_file('index.html')
+
+
+if __name__ == '__main__':
+    app.run()
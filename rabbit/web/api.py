@@ -1,192 +1,404 @@
-import os
-import random
-from datetime import datetime
-from typing import Callable
-
-from flask import abort, Blueprint, Flask, request
-from flask_restx import Api, fields, Resource, reqparse
-from jsonschema import FormatChecker
-from werkzeug.exceptions import default_exceptions
-
-from .decorators import require_poem_scope, plain_text, require_api_key
-from .poem import Poem, PoemManager, PoemType
-from .serialise import serialise_model
-from .storage import add_or_update_article, get_articles, get_text_blob, \
-    articles_by_date_published
-
-
-MAX_ARTICLES=256
-
-
-api_blueprint = Blueprint('api', __name__)
-
-api = Api(
-    api_blueprint,
-    doc='/api', 
-    description='An API for updating and viewing the rabbit.',
-    
-    prefix='/api', 
-    title='🐰 The Rabbit API',
-    version='0.1'
-)
-
-article_model = api.model('Article', {
-    'url': fields.String(
-        example='https://www.bbc.co.uk/news/example-12345678',
-        required=True
-    ),
-    'title': fields.String(
-        example='An Example Article',
-        required=True
-    ),
-    'category': fields.String(
-        example='UK',
-        required=True
-    ),
-    'paragraphs': fields.List(
-        fields.String,
-        example=['First paragraph.', 'Second paragraph.'],
-        required=True
-    ),
-    'date_published': fields.DateTime(
-        example='2020-12-22T11:26:05.594814+00:00',
-        required=True
-    )
-})
-
-poem_model = api.model('Poem', {
-    'paragraphs': fields.List(
-        fields.String,
-        example=['First paragraph.', 'Second paragraph.'],
-        required=True
-    ),
-    'date_generated': fields.DateTime(
-        dt_format='iso8601',
-        example='2020-12-22T11:26:05.594814+00:00',
-        required=True
-    )
-})
-
-poem_with_hash_model = api.inherit('Poem With Hash', poem_model, {
-    'hash': fields.String(
-        example='1fe6ec3ce370e8d710a061afde3eee1d',
-        required=True
-    )
-})
-
-time_range = reqparse.RequestParser()
-
-time_range.add_argument(
-    'from',
-    default='2020-01-01',
-    help='An ISO 8601 formatted date.',
-    required=True,
-    type=datetime.fromisoformat,
-    location='args'
-)
-
-time_range.add_argument(
-    'until',
-    default='2020-02-01',
-    help='An ISO 8601 formatted date.',
-    required=True,
-    type=datetime.fromisoformat,
-    location='args'
-)
-
-
-def require_rabbit_api_key(func: Callable) -> Callable:
-    api_key = os.environ.get('RABBIT_API_KEY', '')
-    return require_api_key(api, api_key)(func)
-
-
-@api.route('/article')
-class ArticleResource(Resource):
-    @api.expect(article_model)
-    @require_rabbit_api_key
-    @plain_text
-    def post(self: object):
-        '''Add or update an article.'''
-        return_code = add_or_update_article(
-            request.json['url'],
-            request.json['title'],
-            request.json['category'],
-            datetime.fromisoformat(request.json['date_published']),
-            request.json['paragraphs']
-        )
-
-        return '', return_code
-
-    @api.expect(time_range)
-    @api.marshal_with(article_model, as_list=True)
-    def get(self: object):
-        '''Fetch articles within a time range.'''
-        args = time_range.parse_args(strict=True)
-        articles = get_articles(args['from'], args['until'])
-
-        if len(articles) > MAX_ARTICLES:
-            articles = random.sample(articles, MAX_ARTICLES)
-
-        return list(map(
-            lambda i: i.json(),
-            articles
-        ))
-
-
-@api.route('/text')
-class TextResource(Resource):
-    @api.expect(time_range)
-    @plain_text
-    def get(self: object):
-        '''Fetch text from articles within a time range.'''
-        args = time_range.parse_args(strict=True)
-        return get_text_blob(args['from'], args['until'])
-
-
-@api.route('/calendar/<int:year>')
-class CalendarResource(Resource):
-    def get(self: object, year: int):
-        return articles_by_date_published(year)
-
-
-@api.route('/poem')
-class PoemResource(Resource):
-    @require_poem_scope(api)
-    def get(self: object):
-        scope = PoemType(request.args['scope'])
-        poem_manager = PoemManager()
-        poem = poem_manager.get_poem(scope)
-        return (poem.json(), 200) if poem else (None, 404)
-
-    @api.expect(poem_with_hash_model)
-    @require_poem_scope(api)
-    @require_rabbit_api_key
-    def post(self: object):
-        scope = PoemType(request.args['scope'])
-        poem = Poem.from_json(request.json)
-        poem_manager = PoemManager()
-        return poem_manager.add_poem(scope, poem), 200
-
-
-@api.route('/saved_poem/<hash>')
-class SavedPoemResource(Resource):
-    @api.marshal_with(poem_model)
-    def get(self: object, hash: str):
-        poem_manager = PoemManager()
-        poem = poem_manager.get_saved_poem(hash)
-        return (poem.json(), 200) if poem else (None, 404)
-
-    @api.expect(poem_model)
-    def post(self: object, hash: str):
-        poem = Poem.from_json(request.json)
-        poem_manager = PoemManager()
-        success = poem_manager.save_poem(poem, hash)
-
-        if not success:
-            abort(401)
-
-        return {'permalink': f'{request.url_root}saved_poem/{poem.hash()}'}
-
-
-def initialise_api(app: Flask) -> None:
-    app.register_blueprint(api_blueprint)
+import os
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+import orjson
+from flask import abort, Blueprint, Flask, request
+from flask_restx import Api, fields, inputs, Resource, reqparse
+from jsonschema import FormatChecker
+from werkzeug.exceptions import default_exceptions
+
+from .decorators import http_cache, make_etag, require_poem_scope, \
+    plain_text, plain_text_stream, require_api_key
+from .poem import Poem, PoemManager, PoemType
+from .serialise import article_serialiser, json_response, poem_serialiser, \
+    poem_with_hash_serialiser, search_result_serialiser
+from ..article import Article as DeserialisedArticle
+from .cache import ResponseCache
+from .storage import add_or_update_article, add_or_update_articles, \
+    get_article_hashes, get_articles, get_last_ingest, iter_text_blob, \
+    articles_by_date_published, search_articles
+
+
+MAX_ARTICLES=256
+MAX_BATCH_ARTICLES=1000
+MAX_SEARCH_RESULTS=100
+
+
+response_cache = ResponseCache(
+    ttl=int(os.environ.get('RABBIT_RESPONSE_CACHE_TTL', 3600)),
+    max_entries=int(os.environ.get('RABBIT_RESPONSE_CACHE_ENTRIES', 256)),
+    max_size=int(os.environ.get('RABBIT_RESPONSE_CACHE_MAX_SIZE', 16 * 1024 * 1024))
+)
+
+# Shared by every request, so that its Lua scripts are only registered once.
+poem_manager = PoemManager()
+
+
+api_blueprint = Blueprint('api', __name__)
+
+api = Api(
+    api_blueprint,
+    doc='/api', 
+    description='An API for updating and viewing the rabbit.',
+    
+    prefix='/api', 
+    title='🐰 The Rabbit API',
+    version='0.1'
+)
+
+article_model = api.model('Article', {
+    'url': fields.String(
+        example='https://www.bbc.co.uk/news/example-12345678',
+        required=True
+    ),
+    'title': fields.String(
+        example='An Example Article',
+        required=True
+    ),
+    'category': fields.String(
+        example='UK',
+        required=True
+    ),
+    'paragraphs': fields.List(
+        fields.String,
+        example=['First paragraph.', 'Second paragraph.'],
+        required=True
+    ),
+    'date_published': fields.DateTime(
+        example='2020-12-22T11:26:05.594814+00:00',
+        required=True
+    )
+})
+
+poem_model = api.model('Poem', {
+    'paragraphs': fields.List(
+        fields.String,
+        example=['First paragraph.', 'Second paragraph.'],
+        required=True
+    ),
+    'date_generated': fields.DateTime(
+        dt_format='iso8601',
+        example='2020-12-22T11:26:05.594814+00:00',
+        required=True
+    )
+})
+
+poem_with_hash_model = api.inherit('Poem With Hash', poem_model, {
+    'hash': fields.String(
+        example='1fe6ec3ce370e8d710a061afde3eee1d',
+        required=True
+    )
+})
+
+time_range = reqparse.RequestParser()
+
+time_range.add_argument(
+    'from',
+    default='2020-01-01',
+    help='An ISO 8601 formatted date.',
+    required=True,
+    type=datetime.fromisoformat,
+    location='args'
+)
+
+time_range.add_argument(
+    'until',
+    default='2020-02-01',
+    help='An ISO 8601 formatted date.',
+    required=True,
+    type=datetime.fromisoformat,
+    location='args'
+)
+
+search_query = reqparse.RequestParser()
+
+search_query.add_argument(
+    'q',
+    help='Words to search article titles and text for.',
+    required=True,
+    location='args'
+)
+
+search_query.add_argument(
+    'page',
+    default=1,
+    help='The page of results to return, starting from 1.',
+    type=inputs.positive,
+    location='args'
+)
+
+search_query.add_argument(
+    'per_page',
+    default=20,
+    help=f'The number of results per page, at most {MAX_SEARCH_RESULTS}.',
+    type=inputs.int_range(1, MAX_SEARCH_RESULTS),
+    location='args'
+)
+
+search_result_model = api.model('Search Result', {
+    'url': fields.String(example='https://www.bbc.co.uk/news/example-12345678'),
+    'title': fields.String(example='An Example Article'),
+    'category': fields.String(example='UK'),
+    'date_published': fields.DateTime(example='2020-12-22T11:26:05.594814'),
+    'rank': fields.Float(example=4.2)
+})
+
+search_results_model = api.model('Search Results', {
+    'total': fields.Integer(example=1),
+    'page': fields.Integer(example=1),
+    'per_page': fields.Integer(example=20),
+    'results': fields.List(fields.Nested(search_result_model))
+})
+
+
+def require_rabbit_api_key(func: Callable) -> Callable:
+    api_key = os.environ.get('RABBIT_API_KEY', '')
+    return require_api_key(api, api_key)(func)
+
+
+def last_ingest() -> Optional[datetime]:
+    result, generation = response_cache.get_last_ingest()
+
+    if result is None:
+        result = get_last_ingest()
+        if result is not None:
+            response_cache.set_last_ingest(result, generation)
+
+    return result
+
+
+def time_range_validator(endpoint: str) -> Callable:
+    def validator(*_args, **_kwargs) -> Tuple[str, Optional[datetime]]:
+        args = time_range.parse_args(strict=True)
+        last_ingest_time = last_ingest()
+        return make_etag(
+            endpoint,
+            args['from'].isoformat(),
+            args['until'].isoformat(),
+            last_ingest_time
+        ), last_ingest_time
+    return validator
+
+
+def calendar_validator(_resource: Resource, year: int):
+    last_ingest_time = last_ingest()
+    return make_etag('calendar', year, last_ingest_time), last_ingest_time
+
+
+def calendar_cache_control(_resource: Resource, year: int) -> str:
+    if year < datetime.utcnow().year:
+        return 'public, max-age=86400'
+    return 'public, no-cache'
+
+
+def search_validator(*_args, **_kwargs) -> Tuple[str, Optional[datetime]]:
+    args = search_query.parse_args(strict=True)
+    last_ingest_time = last_ingest()
+    return make_etag(
+        'search',
+        args['q'],
+        args['page'],
+        args['per_page'],
+        last_ingest_time
+    ), last_ingest_time
+
+
+def saved_poem_validator(_resource: Resource, hash: str):
+    # A saved poem's hash covers its content, so it never changes.
+    return hash, None
+
+
+@api.route('/article')
+class ArticleResource(Resource):
+    @api.expect(article_model)
+    @require_rabbit_api_key
+    @plain_text
+    def post(self: object):
+        '''Add or update an article.'''
+        result = add_or_update_article(
+            request.json['url'],
+            request.json['title'],
+            request.json['category'],
+            datetime.fromisoformat(request.json['date_published']),
+            request.json['paragraphs']
+        )
+        response_cache.invalidate(result.days)
+
+        return '', 201 if result.created else 200
+
+    # Articles are randomly sampled, so responses for the same ingest state
+    # are equivalent rather than byte-identical.
+    @http_cache(time_range_validator('article'), 'public, no-cache', weak=True)
+    @api.expect(time_range)
+    @api.response(200, 'Success', [article_model])
+    def get(self: object):
+        '''Fetch articles within a time range.'''
+        args = time_range.parse_args(strict=True)
+        body, generation = response_cache.get(
+            'article', args['from'], args['until']
+        )
+
+        if body is None:
+            body = article_serialiser.dumps_list(
+                get_articles(args['from'], args['until'], MAX_ARTICLES)
+            )
+            response_cache.set(
+                'article', args['from'], args['until'], body, generation
+            )
+
+        return json_response(body)
+
+
+@api.route('/articles')
+class ArticleBatchResource(Resource):
+    @api.expect([article_model])
+    @require_rabbit_api_key
+    def post(self: object):
+        '''Add or update a batch of articles.'''
+        if len(request.json) > MAX_BATCH_ARTICLES:
+            abort(413)
+
+        result = add_or_update_articles([
+            DeserialisedArticle(
+                i['url'],
+                i['title'],
+                datetime.fromisoformat(i['date_published']),
+                i['paragraphs'],
+                [],
+                i['category']
+            )
+            for i in request.json
+        ])
+        response_cache.invalidate(result.days)
+
+        return {'created': result.created, 'updated': result.updated}, 200
+
+
+@api.route('/article/hashes')
+class ArticleHashResource(Resource):
+    @api.expect(time_range)
+    def get(self: object):
+        '''Fetch the stored content hash of articles within a time range.'''
+        args = time_range.parse_args(strict=True)
+        return get_article_hashes(args['from'], args['until'])
+
+
+@api.route('/text')
+class TextResource(Resource):
+    @http_cache(time_range_validator('text'), 'public, no-cache')
+    @api.expect(time_range)
+    @plain_text_stream
+    def get(self: object):
+        '''Fetch text from articles within a time range.'''
+        args = time_range.parse_args(strict=True)
+        cached, generation = response_cache.get(
+            'text', args['from'], args['until']
+        )
+
+        if cached is not None:
+            return iter([cached.decode()])
+
+        return response_cache.tee(
+            'text',
+            args['from'],
+            args['until'],
+            iter_text_blob(args['from'], args['until']),
+            generation
+        )
+
+
+@api.route('/search')
+class SearchResource(Resource):
+    @http_cache(search_validator, 'public, no-cache')
+    @api.expect(search_query)
+    @api.response(200, 'Success', search_results_model)
+    def get(self: object):
+        '''Search article titles and text, best matches first.'''
+        args = search_query.parse_args(strict=True)
+        total, results = search_articles(
+            args['q'],
+            args['per_page'],
+            (args['page'] - 1) * args['per_page']
+        )
+
+        return json_response(orjson.dumps({
+            'total': total,
+            'page': args['page'],
+            'per_page': args['per_page'],
+            'results': list(map(search_result_serialiser, results))
+        }))
+
+
+@api.route('/calendar/<int:year>')
+class CalendarResource(Resource):
+    @http_cache(calendar_validator, calendar_cache_control)
+    def get(self: object, year: int):
+        start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+        body, generation = response_cache.get('calendar', start, end)
+
+        if body is None:
+            body = orjson.dumps(articles_by_date_published(year))
+            response_cache.set('calendar', start, end, body, generation)
+
+        return json_response(body)
+
+
+@api.route('/poem')
+class PoemResource(Resource):
+    @require_poem_scope(api)
+    @api.response(200, 'Success', poem_with_hash_model)
+    def get(self: object):
+        scope = PoemType(request.args['scope'])
+        poem = poem_manager.get_poem(scope)
+
+        if not poem:
+            return json_response(b'null', 404)
+
+        return json_response(poem_with_hash_serialiser.dumps(poem))
+
+    @api.expect(poem_with_hash_model)
+    @require_poem_scope(api)
+    @require_rabbit_api_key
+    def post(self: object):
+        scope = PoemType(request.args['scope'])
+        poem = Poem.from_json(request.json)
+        return poem_manager.add_poem(scope, poem), 200
+
+
+@api.route('/poems')
+class PoemBatchResource(Resource):
+    @api.expect([poem_with_hash_model])
+    @require_poem_scope(api)
+    @require_rabbit_api_key
+    def post(self: object):
+        scope = PoemType(request.args['scope'])
+        poems = [Poem.from_json(i) for i in request.json]
+
+        if poems:
+            poem_manager.add_poems(scope, poems)
+
+        return {'added': len(poems)}, 200
+
+
+@api.route('/saved_poem/<hash>')
+class SavedPoemResource(Resource):
+    @http_cache(saved_poem_validator, 'public, max-age=31536000, immutable')
+    @api.response(200, 'Success', poem_model)
+    def get(self: object, hash: str):
+        poem = poem_manager.get_saved_poem(hash)
+        return json_response(poem_serialiser.dumps(poem), 200 if poem else 404)
+
+    @api.expect(poem_model)
+    def post(self: object, hash: str):
+        poem = Poem.from_json(request.json)
+        success = poem_manager.save_poem(poem, hash)
+
+        if not success:
+            abort(401)
+
+        return {'permalink': f'{request.url_root}saved_poem/{poem.hash()}'}
+
+
+def initialise_api(app: Flask) -> None:
+    app.register_blueprint(api_blueprint)
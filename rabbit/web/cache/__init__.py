@@ -0,0 +1,273 @@
+import os
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from threading import Lock
+from typing import Iterable, Iterator, List, Optional
+
+from redis import BlockingConnectionPool, StrictRedis
+from redis.client import Pipeline
+from redis.exceptions import RedisError
+
+from ...logger import logger
+from ..metrics import record_redis_round_trip
+
+
+_connection_pool: Optional[BlockingConnectionPool] = None
+_connection_pool_lock = Lock()
+
+# A cached value along with the cache generation it was read at. Writes
+# based on a read are only stored if the generation is still the same.
+CachedValue = namedtuple('CachedValue', ['value', 'generation'])
+
+# Stores a value unless the generation has moved on since the caller read
+# it, which means an ingest invalidated the cache while the value was being
+# computed. Entries with a range are also added to the index, and the
+# number of indexed entries is returned, or -1 if the write was rejected.
+#
+# KEYS: generation, entry[, index, ranges]
+# ARGV: generation read, value, ttl[, timestamp, range]
+SET_SCRIPT = '''
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return -1
+end
+
+redis.call('SET', KEYS[2], ARGV[2], 'EX', tonumber(ARGV[3]))
+
+if #KEYS == 2 then
+    return 0
+end
+
+redis.call('ZADD', KEYS[3], ARGV[4], KEYS[2])
+redis.call('HSET', KEYS[4], KEYS[2], ARGV[5])
+return redis.call('ZCARD', KEYS[3])
+'''
+
+
+def _create_connection_pool() -> BlockingConnectionPool:
+    return BlockingConnectionPool(
+        host=os.environ.get('RABBIT_CACHE_HOST', 'localhost'),
+        port=int(os.environ.get('RABBIT_CACHE_PORT', 6379)),
+        max_connections=int(os.environ.get('RABBIT_CACHE_POOL_SIZE', 16)),
+        timeout=float(os.environ.get('RABBIT_CACHE_POOL_TIMEOUT', 5)),
+        socket_timeout=float(os.environ.get('RABBIT_CACHE_SOCKET_TIMEOUT', 5)),
+        socket_connect_timeout=float(
+            os.environ.get('RABBIT_CACHE_CONNECT_TIMEOUT', 2)
+        )
+    )
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self: object, raise_on_error: bool = True) -> list:
+        if self.command_stack:
+            record_redis_round_trip('PIPELINE')
+        return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(StrictRedis):
+    '''A Redis client that counts its round trips for the metrics endpoint.'''
+
+    def execute_command(self: object, *args, **options):
+        record_redis_round_trip(args[0])
+        return super().execute_command(*args, **options)
+
+    def pipeline(
+        self: object,
+        transaction: bool = True,
+        shard_hint: Optional[str] = None
+    ) -> InstrumentedPipeline:
+        return InstrumentedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint
+        )
+
+
+def get_redis_client() -> StrictRedis:
+    '''
+    Return a Redis client backed by the connection pool shared by every
+    request in this process. redis-py resets the pool after a fork, so each
+    gunicorn worker ends up with its own connections.
+    '''
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = _create_connection_pool()
+
+    return InstrumentedRedis(connection_pool=_connection_pool)
+
+
+class ResponseCache:
+    '''
+    Caches responses to date range queries in Redis.
+
+    Entries are keyed on the endpoint and the normalised range they cover,
+    expire after ttl seconds and are evicted oldest first once more than
+    max_entries exist. Ingests invalidate every entry whose range contains
+    one of the days they touched, and bump a generation counter so that
+    responses computed before the ingest are not written back afterwards.
+    Redis errors are logged and treated as cache misses so that reads keep
+    working without the cache.
+    '''
+
+    index_key = 'response-cache-index'
+    ranges_key = 'response-cache-ranges'
+    last_ingest_key = 'response-cache-last-ingest'
+    generation_key = 'response-cache-generation'
+
+    def __init__(
+        self: object,
+        ttl: int = 3600,
+        max_entries: int = 256,
+        max_size: int = 16 * 1024 * 1024
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_size = max_size
+        # Registering only computes the hash, and any client can run it.
+        self.set_script = get_redis_client().register_script(SET_SCRIPT)
+
+    @staticmethod
+    def key(endpoint: str, min: datetime, max: datetime) -> str:
+        return f'response-cache:{endpoint}:{min.isoformat()}:{max.isoformat()}'
+
+    def _get(self: object, key: str) -> CachedValue:
+        try:
+            value, generation = get_redis_client().mget(key, self.generation_key)
+        except RedisError as error:
+            logger.warning(f'Response cache read failed: {error}')
+            return CachedValue(None, None)
+
+        return CachedValue(value, int(generation or 0))
+
+    def get(self: object, endpoint: str, min: datetime, max: datetime) -> CachedValue:
+        '''
+        Read a cached response. Read it before computing the response, and
+        pass the generation it returns to set.
+        '''
+        return self._get(ResponseCache.key(endpoint, min, max))
+
+    def set(
+        self: object,
+        endpoint: str,
+        min: datetime,
+        max: datetime,
+        value: bytes,
+        generation: Optional[int]
+    ) -> None:
+        if len(value) > self.max_size or generation is None:
+            return
+
+        key = ResponseCache.key(endpoint, min, max)
+
+        try:
+            redis_client = get_redis_client()
+            overflow = self.set_script(
+                keys=[self.generation_key, key, self.index_key, self.ranges_key],
+                args=[
+                    generation,
+                    value,
+                    self.ttl,
+                    time.time(),
+                    f'{_timestamp(min)} {_timestamp(max)}'
+                ],
+                client=redis_client
+            ) - self.max_entries
+
+            if overflow > 0:
+                evicted = [i for i, _ in redis_client.zpopmin(self.index_key, overflow)]
+                self._delete(redis_client, evicted)
+        except RedisError as error:
+            logger.warning(f'Response cache write failed: {error}')
+
+    def get_last_ingest(self: object) -> CachedValue:
+        value, generation = self._get(self.last_ingest_key)
+        return CachedValue(
+            value and datetime.fromisoformat(value.decode()),
+            generation
+        )
+
+    def set_last_ingest(
+        self: object,
+        last_ingest: datetime,
+        generation: Optional[int]
+    ) -> None:
+        if generation is None:
+            return
+
+        try:
+            self.set_script(
+                keys=[self.generation_key, self.last_ingest_key],
+                args=[generation, last_ingest.isoformat(), 60],
+                client=get_redis_client()
+            )
+        except RedisError as error:
+            logger.warning(f'Response cache write failed: {error}')
+
+    def tee(
+        self: object,
+        endpoint: str,
+        min: datetime,
+        max: datetime,
+        chunks: Iterator[str],
+        generation: Optional[int]
+    ) -> Iterator[str]:
+        '''Pass chunks through, caching them once the stream completes.'''
+        buffer = []
+        size = 0
+
+        for chunk in chunks:
+            if buffer is not None:
+                buffer.append(chunk)
+                size += len(chunk)
+                if size > self.max_size:
+                    buffer = None
+            yield chunk
+
+        if buffer is not None:
+            self.set(endpoint, min, max, ''.join(buffer).encode(), generation)
+
+    def invalidate(self: object, days: Iterable[date]) -> None:
+        '''Drop every entry whose range overlaps one of the given days.'''
+        days = [
+            (
+                _timestamp(datetime.combine(i, datetime.min.time())),
+                _timestamp(datetime.combine(i + timedelta(days=1), datetime.min.time()))
+            )
+            for i in days
+        ]
+
+        try:
+            redis_client = get_redis_client()
+            # Reject writes of anything read before this ingest first.
+            redis_client.incr(self.generation_key)
+            stale = [self.last_ingest_key]
+
+            for key, value in redis_client.hgetall(self.ranges_key).items():
+                start, end = map(float, value.split())
+                if any(start < day_end and day_start <= end for day_start, day_end in days):
+                    stale.append(key)
+
+            self._delete(redis_client, stale)
+        except RedisError as error:
+            logger.error(f'Response cache invalidation failed: {error}')
+
+    def _delete(self: object, redis_client: StrictRedis, keys: List[bytes]) -> None:
+        if not keys:
+            return
+
+        pipeline = redis_client.pipeline()
+        pipeline.delete(*keys)
+        pipeline.zrem(self.index_key, *keys)
+        pipeline.hdel(self.ranges_key, *keys)
+        pipeline.execute()
+
+
+
+def _timestamp(date: datetime) -> float:
+    # Naive datetimes are UTC throughout storage.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
@@ -0,0 +1,119 @@
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Flask, Response, current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class ZlibCompressor:
+    def __init__(self: object, wbits: int, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self: object, data: bytes) -> bytes:
+        # Flush every chunk so that streamed responses keep streaming.
+        return self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self: object) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self: object, level: int):
+        # Brotli qualities run from 0 to 11 rather than 1 to 9.
+        self.compressor = brotli.Compressor(quality=min(11, level))
+
+    def compress(self: object, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self: object) -> bytes:
+        return self.compressor.finish()
+
+
+COMPRESSORS = {
+    'gzip': lambda level: ZlibCompressor(16 + zlib.MAX_WBITS, level),
+    'deflate': lambda level: ZlibCompressor(zlib.MAX_WBITS, level)
+}
+
+if brotli is not None:
+    COMPRESSORS = {
+        'br': lambda level: BrotliCompressor(level),
+        **COMPRESSORS
+    }
+
+
+def _choose_encoding() -> Optional[str]:
+    # Ties in quality go to the first encoding listed in COMPRESSORS.
+    encoding = request.accept_encodings.best_match(list(COMPRESSORS))
+    return encoding if encoding in COMPRESSORS else None
+
+
+def _compress_stream(chunks: Iterable[bytes], compressor: object) -> Iterator[bytes]:
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # Closing the original iterable ends stream_with_context's request.
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response: Response) -> Response:
+    '''
+    Compress responses of the configured content types with the best
+    encoding the client accepts. Buffered responses smaller than the
+    minimum size are left alone, while streamed responses are compressed
+    chunk by chunk as they are sent.
+    '''
+    config = current_app.config
+
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+
+    if response.mimetype not in config['COMPRESSION_MIMETYPES'] or \
+            response.direct_passthrough:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+
+    if encoding is None or response.status_code < 200 or \
+            response.status_code == 204 or \
+            'Content-Encoding' in response.headers:
+        return response
+
+    if not response.is_streamed and \
+            response.calculate_content_length() < config['COMPRESSION_MIN_SIZE']:
+        return response
+
+    compressor = COMPRESSORS[encoding](config['COMPRESSION_LEVEL'])
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(
+            compressor.compress(response.get_data()) + compressor.finish()
+        )
+
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed body is a different representation, so a strong ETag
+    # can only be kept as a weak one. http_cache compares weakly anyway.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def initialise_compression(app: Flask) -> None:
+    app.after_request(compress_response)
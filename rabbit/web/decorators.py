@@ -1,50 +1,125 @@
-from functools import wraps
-from typing import Callable
-
-from flask import abort, request
-from flask.helpers import make_response
-from flask_restx import Api
-
-from .poem import PoemType
-
-
-def require_poem_scope(api: Api) -> Callable:
-    def decorator(func: Callable) -> Callable:
-        decorated_func = api.param(
-            'scope',
-            'The scope of the poem.',
-            enum=[i.value for i in PoemType],
-            required=True
-        )(func)
-        @wraps(decorated_func)
-        def wrapper(*args, **kwargs) -> Callable:
-            return decorated_func(*args, **kwargs)
-        return wrapper
-    return decorator
-
-
-def require_api_key(api: Api, api_key: str) -> Callable:
-    def decorator(func: Callable) -> Callable:
-        decorated_func = api.param(
-            'X-Api-Key',
-            'This action requires an API key.',
-            'header',
-            required=True
-        )(func)
-        @wraps(decorated_func)
-        def wrapper(*args, **kwargs):
-            if request.headers.get('X-Api-Key') != api_key:
-                abort(403)
-            return decorated_func(*args, **kwargs)
-        return wrapper
-    return decorator
-
-
-def plain_text(func: Callable) -> Callable:
-    @wraps(func)
-    def wrapper(*args, **kwargs) -> Callable:
-        result = func(*args, **kwargs)
-        response = make_response(result)
-        response.mimetype = 'text/plain'
-        return response
-    return wrapper
\ No newline at end of file
+from datetime import datetime, timezone
+from functools import wraps
+from hashlib import md5
+from typing import Callable, Optional, Tuple, Union
+
+from flask import abort, request, Response, stream_with_context
+from flask.helpers import make_response
+from flask_restx import Api
+from flask_restx.utils import unpack
+from werkzeug.http import http_date, quote_etag
+
+from .poem import PoemType
+
+
+def require_poem_scope(api: Api) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        decorated_func = api.param(
+            'scope',
+            'The scope of the poem.',
+            enum=[i.value for i in PoemType],
+            required=True
+        )(func)
+        @wraps(decorated_func)
+        def wrapper(*args, **kwargs) -> Callable:
+            return decorated_func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def require_api_key(api: Api, api_key: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        decorated_func = api.param(
+            'X-Api-Key',
+            'This action requires an API key.',
+            'header',
+            required=True
+        )(func)
+        @wraps(decorated_func)
+        def wrapper(*args, **kwargs):
+            if request.headers.get('X-Api-Key') != api_key:
+                abort(403)
+            return decorated_func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def plain_text(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> Callable:
+        result = func(*args, **kwargs)
+        response = make_response(result)
+        response.mimetype = 'text/plain'
+        return response
+    return wrapper
+
+
+def plain_text_stream(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> Response:
+        result = func(*args, **kwargs)
+        return Response(stream_with_context(result), mimetype='text/plain')
+    return wrapper
+
+
+def make_etag(*parts: object) -> str:
+    return md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _as_utc(date: datetime) -> datetime:
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def _is_not_modified(etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    if request.if_none_match:
+        return bool(etag) and request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return _as_utc(request.if_modified_since) >= _as_utc(last_modified)
+    return False
+
+
+def http_cache(
+    validator: Callable[..., Tuple[Optional[str], Optional[datetime]]],
+    cache_control: Union[str, Callable[..., str]],
+    weak: bool = False
+) -> Callable:
+    '''
+    Add ETag, Last-Modified and Cache-Control headers to successful
+    responses. The validator is called with the view's arguments and must be
+    cheap: conditional requests it matches are answered with 304 before the
+    view runs.
+    '''
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validator(*args, **kwargs)
+            headers = {
+                'Cache-Control': cache_control(*args, **kwargs)
+                    if callable(cache_control) else cache_control
+            }
+
+            if etag:
+                headers['ETag'] = quote_etag(etag, weak)
+            if last_modified:
+                headers['Last-Modified'] = http_date(_as_utc(last_modified))
+
+            if _is_not_modified(etag, last_modified):
+                return Response(status=304, headers=headers)
+
+            result = func(*args, **kwargs)
+
+            if isinstance(result, Response):
+                if result.status_code == 200:
+                    result.headers.extend(headers)
+                return result
+
+            data, code, result_headers = unpack(result)
+
+            if code == 200:
+                result_headers = {**headers, **(result_headers or {})}
+
+            return data, code, result_headers
+        return wrapper
+    return decorator
\ No newline at end of file
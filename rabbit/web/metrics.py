@@ -0,0 +1,140 @@
+import os
+from time import perf_counter
+from typing import Optional
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..metrics import CONTENT_TYPE, read_metrics, registry, \
+    start_metrics_writer, write_metrics
+
+
+METRICS_DIR = os.environ.get('RABBIT_METRICS_DIR')
+METRICS_INTERVAL = float(os.environ.get('RABBIT_METRICS_INTERVAL', 5))
+
+# The worker process whose writer thread is running, if any.
+_writer_pid: Optional[int] = None
+
+
+request_seconds = registry.histogram(
+    'rabbit_web_request_seconds',
+    'Time taken to handle a request, including streamed bodies.',
+    ['route', 'method', 'status']
+)
+request_sql_queries = registry.histogram(
+    'rabbit_web_request_sql_queries',
+    'SQL queries executed per request.',
+    ['route'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+request_sql_seconds = registry.histogram(
+    'rabbit_web_request_sql_seconds',
+    'Time spent executing SQL per request.',
+    ['route']
+)
+request_redis_round_trips = registry.histogram(
+    'rabbit_web_request_redis_round_trips',
+    'Redis round trips per request.',
+    ['route'],
+    buckets=(0, 1, 2, 5, 10, 20, 50)
+)
+redis_round_trips = registry.counter(
+    'rabbit_redis_round_trips_total',
+    'Round trips to Redis, a pipeline counting as one.',
+    ['command']
+)
+
+
+def record_redis_round_trip(command: str) -> None:
+    redis_round_trips.inc(command=command)
+
+    if has_request_context():
+        g.redis_round_trips = g.get('redis_round_trips', 0) + 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is discarded with the statement
+    # whether or not it succeeds.
+    if context is not None:
+        context.rabbit_query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'rabbit_query_start', None)
+
+    if start is None:
+        return
+
+    elapsed = perf_counter() - start
+
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+
+def _start_writer() -> None:
+    global _writer_pid
+
+    # Started on the first request rather than at import, so that each
+    # gunicorn worker gets its own thread even if the app was preloaded.
+    if _writer_pid != os.getpid():
+        _writer_pid = os.getpid()
+        start_metrics_writer(METRICS_DIR, METRICS_INTERVAL)
+
+
+def _start_request() -> None:
+    if METRICS_DIR:
+        _start_writer()
+
+    g.request_start = perf_counter()
+
+
+def _record_status(response: Response) -> Response:
+    g.status = response.status_code
+    return response
+
+
+def _record_request(_error: Exception) -> None:
+    # Runs when the request context is popped, which for streamed responses
+    # is only once the body has been sent.
+    if 'request_start' not in g:
+        return
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    request_seconds.observe(
+        perf_counter() - g.request_start,
+        route=route,
+        method=request.method,
+        status=g.get('status', 500)
+    )
+    request_sql_queries.observe(g.get('sql_queries', 0), route=route)
+    request_sql_seconds.observe(g.get('sql_seconds', 0.0), route=route)
+    request_redis_round_trips.observe(g.get('redis_round_trips', 0), route=route)
+
+
+def metrics() -> Response:
+    if not METRICS_DIR:
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    # Other workers' files are at most METRICS_INTERVAL seconds old.
+    write_metrics(METRICS_DIR)
+    return Response(read_metrics(METRICS_DIR).render(), content_type=CONTENT_TYPE)
+
+
+def initialise_metrics(app: Flask):
+    '''
+    Expose metrics at /metrics. With RABBIT_METRICS_DIR set, every gunicorn
+    worker writes its registry to that directory and a scrape sums them
+    all, whichever worker answers it. The directory must be emptied before
+    the workers start, see rabbit.gunicorn_config. Without it, a scrape
+    only covers the worker that answered it.
+    '''
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
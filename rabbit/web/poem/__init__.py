@@ -1,15 +1,62 @@
 import json
 import os
+import random
 from datetime import datetime
 from enum import Enum
 from hashlib import md5
 from typing import List, Optional
 
-from redis import StrictRedis
+from ..cache import get_redis_client
 
 
 RABBIT_POEM_SALT = os.environ.get('RABBIT_POEM_SALT', '')
 
+# Serves a poem and asks the poem builder for more once fewer than the low
+# watermark are left in the list. Pop mode consumes poems, so the list
+# drains as it is read. The other modes treat the list as a ring buffer,
+# either advancing a shared cursor so that consecutive readers are handed
+# consecutive poems or reading at a caller supplied fraction of its length,
+# and only ask for more while the buffer is still filling up.
+#
+# KEYS: list, cursor, refill pending flag, refill signal
+# ARGV: serving mode, random fraction, low watermark, pending flag ttl
+SERVE_SCRIPT = '''
+local length = redis.call('LLEN', KEYS[1])
+local poem = false
+
+if length > 0 then
+    if ARGV[1] == 'pop' then
+        poem = redis.call('RPOP', KEYS[1])
+        length = length - 1
+    else
+        local index
+        if ARGV[1] == 'random' then
+            index = math.floor(tonumber(ARGV[2]) * length)
+        else
+            index = redis.call('INCR', KEYS[2]) % length
+        end
+        poem = redis.call('LINDEX', KEYS[1], index)
+    end
+end
+
+if length < tonumber(ARGV[3]) and
+        redis.call('SET', KEYS[3], 1, 'NX', 'EX', tonumber(ARGV[4])) then
+    redis.call('LPUSH', KEYS[4], 1)
+end
+
+return poem
+'''
+
+# Adds poems and clears any outstanding refill request.
+#
+# KEYS: list, refill pending flag, refill signal
+# ARGV: last index to keep, poems...
+ADD_SCRIPT = '''
+redis.call('LPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]))
+redis.call('DEL', KEYS[2], KEYS[3])
+'''
+
 
 class PoemType(Enum):
     Day = 'day'
@@ -17,6 +64,12 @@ class PoemType(Enum):
     Year = 'year'
 
 
+class PoemServing(Enum):
+    Pop = 'pop'
+    Random = 'random'
+    RoundRobin = 'round-robin'
+
+
 class Poem:
     def __init__(
         self: object,
@@ -50,27 +103,57 @@ class Poem:
 
 class PoemManager:
     def __init__(self: object):
-        self.host = os.environ.get('RABBIT_CACHE_HOST')
-        self.port = os.environ.get('RABBIT_CACHE_PORT')
-
         self.max_poems = 100
-
-        self.redis_client = StrictRedis(
-            host=self.host,
-            port=self.port
+        self.low_watermark = int(os.environ.get('RABBIT_POEM_LOW_WATERMARK', 5))
+        # Ask again if a refill has not arrived within this many seconds.
+        self.refill_retry = 60
+        self.serving = PoemServing(
+            os.environ.get('RABBIT_POEM_SERVING', PoemServing.RoundRobin.value)
         )
+        self.redis_client = get_redis_client()
+        # Registered once, as each registration hashes the script again.
+        self.serve_script = self.redis_client.register_script(SERVE_SCRIPT)
+        self.add_script = self.redis_client.register_script(ADD_SCRIPT)
 
-    def get_poem(self: object, type: PoemType) -> Optional[Poem]:
+    @staticmethod
+    def _keys(type: PoemType) -> List[str]:
         key = f'poem-{type.value}'
-        encoded_poem = self.redis_client.rpop(key)
+        return [
+            key,
+            f'{key}-cursor',
+            f'{key}-refill-pending',
+            f'{key}-refill'
+        ]
+
+    def get_poem(self: object, type: PoemType) -> Optional[Poem]:
+        encoded_poem = self.serve_script(
+            keys=PoemManager._keys(type),
+            args=[
+                self.serving.value,
+                random.random(),
+                self.low_watermark,
+                self.refill_retry
+            ]
+        )
 
         return encoded_poem and Poem.from_json(json.loads(encoded_poem))
      
     def add_poem(self: object, type: PoemType, poem: Poem) -> None:
-        key = f'poem-{type.value}'
-        encoded_poem = json.dumps(poem.json())
-        self.redis_client.lpush(key, encoded_poem)
-        self.redis_client.ltrim(key, 0, self.max_poems)
+        self.add_poems(type, [poem])
+
+    def add_poems(self: object, type: PoemType, poems: List[Poem]) -> None:
+        key, _cursor, pending, refill = PoemManager._keys(type)
+        self.add_script(
+            keys=[key, pending, refill],
+            args=[self.max_poems] + [json.dumps(i.json()) for i in poems]
+        )
+
+    def wait_for_refill(self: object, type: PoemType, timeout: int) -> bool:
+        '''
+        Block until readers ask for more poems, or the timeout passes. The
+        timeout must be shorter than the Redis socket timeout.
+        '''
+        return bool(self.redis_client.blpop(PoemManager._keys(type)[-1], timeout))
      
     def save_poem(self: object, poem: Poem, provided_hash: str) -> bool:
         if provided_hash != poem.hash():
@@ -81,7 +164,7 @@ class PoemManager:
             return False
 
         encoded_poem = json.dumps(poem.json())
-        self.redis_client.hmset('saved-poems', {provided_hash: encoded_poem})
+        self.redis_client.hset('saved-poems', provided_hash, encoded_poem)
 
         return True
 
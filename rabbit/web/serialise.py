@@ -1,25 +1,65 @@
-from datetime import datetime
-from typing import List
-
-from flask_sqlalchemy import Model
-
-
-def is_valid_attribute(attr: str) -> bool:
-    return attr not in {'metadata', 'query', 'query_class'} and not attr.startswith('_')
-
-
-def model_attributes(model: Model) -> List[str]:
-    return list(filter(is_valid_attribute, dir(model)))
-
-
-def serialise_attribute(attr: object) -> object:
-    if isinstance(attr, datetime):
-        return attr.isoformat()
-    if isinstance(attr, Model):
-        return str(attr)
-    return attr
-
-
-def serialise_model(model: Model) -> dict:
-    attributes = {i: getattr(model, i) for i in model_attributes(model)}
-    return {k: serialise_attribute(v) for k, v in attributes.items()}
\ No newline at end of file
+from operator import attrgetter
+from typing import Dict, Iterable, Optional
+
+import orjson
+from flask import Response
+
+
+class Serialiser:
+    '''
+    Serialises objects to JSON using a field mapping compiled once up front.
+
+    Fields map an output key to either an attribute name or a callable
+    taking the object. Datetimes are left to orjson, which writes them in
+    the same ISO 8601 form as flask_restx's DateTime field.
+    '''
+
+    def __init__(self: object, fields: Dict[str, object]):
+        self.keys = tuple(fields)
+        self.getters = tuple(
+            i if callable(i) else attrgetter(i)
+            for i in fields.values()
+        )
+
+    def __call__(self: object, obj: Optional[object]) -> dict:
+        if obj is None:
+            return dict.fromkeys(self.keys)
+        return {k: getter(obj) for k, getter in zip(self.keys, self.getters)}
+
+    def dumps(self: object, obj: Optional[object]) -> bytes:
+        return orjson.dumps(self(obj))
+
+    def dumps_list(self: object, objs: Iterable[object]) -> bytes:
+        return orjson.dumps(list(map(self, objs)))
+
+
+article_serialiser = Serialiser({
+    'url': 'url',
+    'title': 'title',
+    'category': 'category',
+    'paragraphs': lambda i: [j.text for j in i.paragraphs],
+    'date_published': 'date_published'
+})
+
+poem_serialiser = Serialiser({
+    'paragraphs': 'paragraphs',
+    'date_generated': 'date_generated'
+})
+
+poem_with_hash_serialiser = Serialiser({
+    'paragraphs': 'paragraphs',
+    'date_generated': 'date_generated',
+    'hash': lambda i: i.hash()
+})
+
+search_result_serialiser = Serialiser({
+    'url': 'url',
+    'title': 'title',
+    'category': 'category',
+    'date_published': 'date_published',
+    'rank': 'rank'
+})
+
+
+def json_response(body: bytes, status: int = 200) -> Response:
+    return Response(body, status, mimetype='application/json')
@@ -1,21 +1,109 @@
-from datetime import datetime
-from typing import Dict, List
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Set
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from retry import retry
+from sqlalchemy import func, inspect, Table, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Query, selectinload
+from sqlalchemy.sql.expression import Executable
 
 from ...article import Article as DeserialisedArticle
-from .schema import db, Article, Paragraph
-from ..serialise import serialise_model
+from .schema import db, Article, DailyArticleCount, DailyCorpus, IngestState, \
+    Paragraph
+from .search import index_articles, initialise_search, search_articles
 
 
-@retry(exceptions=[IntegrityError, OperationalError], delay=1, tries=3)
+IngestResult = namedtuple('IngestResult', ['created', 'updated', 'days'])
+
+# PostgreSQL advisory lock held while a worker sets up the database.
+STORAGE_LOCK = 0x726162626974
+
+
+@retry(exceptions=(IntegrityError, OperationalError), delay=1, tries=3)
 def initialise_storage(app: Flask) -> None:
     db.init_app(app)
-    with app.app_context():
+    with app.app_context(), _exclusive(STORAGE_LOCK):
         db.create_all()
+        _migrate()
+
+        # Backfill tables added after the database was created.
+        if not DailyArticleCount.query.first():
+            _refresh_daily_counts(_all_days())
+            db.session.commit()
+
+        _backfill_daily_corpus()
+        initialise_search()
+
+
+@contextmanager
+def _exclusive(key: int) -> Iterator[None]:
+    '''
+    Run the block in one process at a time. Every gunicorn worker sets up
+    storage on startup, so the first does the work while the others wait
+    and then find nothing left to do. SQLite serialises writers itself.
+    '''
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+
+    # Held on a connection of its own, as the session's is returned to the
+    # pool on every commit.
+    with db.engine.connect() as connection:
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': key})
+        try:
+            yield
+        finally:
+            connection.execute(
+                text('SELECT pg_advisory_unlock(:key)'),
+                {'key': key}
+            )
+
+
+def _backfill_daily_corpus(days_per_commit: int = 30) -> None:
+    '''
+    Build the corpus of every day with articles but no corpus yet. Groups
+    of days are committed as they are built, so memory stays bounded and
+    an interrupted backfill resumes where it stopped.
+    '''
+    days = [i for (i,) in db.session.query(DailyArticleCount.day).filter(
+        ~DailyArticleCount.day.in_(db.session.query(DailyCorpus.day))
+    ).order_by(DailyArticleCount.day)]
+
+    for chunk in _chunks(days, days_per_commit):
+        _refresh_daily_corpus(set(chunk))
+        db.session.commit()
+
+
+def _migrate() -> None:
+    '''Bring tables created by older versions up to date with the schema.'''
+    columns = {i['name'] for i in inspect(db.engine).get_columns('article')}
+
+    if 'content_hash' not in columns:
+        # Workers start together, so let PostgreSQL tolerate a lost race.
+        # On SQLite the duplicate column error is retried instead.
+        if_not_exists = 'IF NOT EXISTS ' \
+            if db.engine.dialect.name == 'postgresql' else ''
+        db.session.execute(text(
+            f'ALTER TABLE article ADD COLUMN {if_not_exists}content_hash VARCHAR'
+        ))
+
+    # Named as create_all names them for new databases.
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_article_date_published '
+        'ON article (date_published)'
+    ))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_paragraph_article_url '
+        'ON paragraph (article_url)'
+    ))
+    db.session.commit()
 
 
 def add_or_update_article(
@@ -24,70 +112,311 @@ def add_or_update_article(
     category: str,
     date_published: datetime,
     paragraphs: List[str]
-) -> int:
-    article = Article.query.filter_by(url=url).one_or_none()
+) -> IngestResult:
+    return add_or_update_articles([
+        DeserialisedArticle(url, title, date_published, paragraphs, [], category)
+    ])
 
-    if article:
-        return_code = 200
-    else:
-        article = Article()
-        return_code = 201
 
-    article.url = url
-    article.title = title
-    article.category = category
-    article.date_published = date_published
+def add_or_update_articles(articles: List[DeserialisedArticle]) -> IngestResult:
+    '''
+    Upsert a batch of articles and replace their paragraphs in a single
+    transaction. Returns the number of articles created and updated, and
+    the publication days whose contents changed.
+    '''
+    articles = list({i.url: i for i in articles}.values())
+    urls = [i.url for i in articles]
+    existing = {}
+
+    for chunk in _chunks(urls):
+        existing.update(db.session.query(
+            Article.url,
+            Article.date_published
+        ).filter(Article.url.in_(chunk)))
+
+    touched_days = {_as_naive_utc(i.date).date() for i in articles} | \
+        {i.date() for i in existing.values()}
 
-    for paragraph in article.paragraphs:
-        db.session.delete(paragraph)
+    article_rows = [{
+        'url': i.url,
+        'title': i.title,
+        'category': i.category,
+        'date_published': _as_naive_utc(i.date),
+        'content_hash': i.hash()
+    } for i in articles]
 
-    for paragraph in paragraphs:
-        db.session.add(Paragraph(text=paragraph, article=article))
+    paragraph_rows = [
+        {'article_url': i.url, 'text': paragraph}
+        for i in articles
+        for paragraph in i.content
+    ]
+
+    for chunk in _chunks(article_rows):
+        db.session.execute(_upsert(Article.__table__, chunk, 'url'))
+
+    for chunk in _chunks(urls):
+        db.session.execute(Paragraph.__table__.delete().where(
+            Paragraph.article_url.in_(chunk)
+        ))
+
+    if paragraph_rows:
+        db.session.execute(Paragraph.__table__.insert(), paragraph_rows)
+
+    index_articles(articles)
+    _refresh_daily_counts(touched_days)
+    _refresh_daily_corpus(touched_days)
+
+    db.session.execute(_upsert(
+        IngestState.__table__,
+        [{'id': 1, 'last_ingest': datetime.utcnow()}],
+        'id'
+    ))
 
-    db.session.add(article)
     db.session.commit()
 
-    return return_code
+    return IngestResult(len(urls) - len(existing), len(existing), touched_days)
+
+
+def _refresh_daily_counts(days: Set[date]) -> None:
+    '''Recount the articles published on each of the given days.'''
+    if not days:
+        return
+
+    day = func.date(Article.date_published)
+    counts = db.session.query(day, func.count()).filter(
+        Article.date_published >= datetime.combine(min(days), time()),
+        Article.date_published < datetime.combine(
+            max(days) + timedelta(days=1),
+            time()
+        )
+    ).group_by(day)
+
+    # SQLite returns DATE() as a string, PostgreSQL as a date.
+    counts = {date.fromisoformat(str(k)): v for k, v in counts}
+    rows = [{'day': i, 'count': counts[i]} for i in days if i in counts]
+    empty_days = [i for i in days if i not in counts]
+
+    for chunk in _chunks(rows):
+        db.session.execute(_upsert(DailyArticleCount.__table__, chunk, 'day'))
+
+    for chunk in _chunks(empty_days):
+        db.session.execute(DailyArticleCount.__table__.delete().where(
+            DailyArticleCount.day.in_(chunk)
+        ))
+
+
+def _refresh_daily_corpus(days: Set[date]) -> None:
+    '''Rebuild the compressed text of each of the given days.'''
+    # Written a few days at a time, so that only their text is held at once.
+    for chunk in _chunks(sorted(days), 10):
+        rows = []
+        empty_days = []
+
+        for day in chunk:
+            start = datetime.combine(day, time())
+            day_text = '\n'.join(i for (i,) in _paragraph_text(
+                Article.date_published >= start,
+                Article.date_published < start + timedelta(days=1)
+            ))
+
+            if day_text:
+                rows.append({'day': day, 'text': zlib.compress(day_text.encode())})
+            else:
+                empty_days.append(day)
+
+        if rows:
+            db.session.execute(_upsert(DailyCorpus.__table__, rows, 'day'))
+
+        if empty_days:
+            db.session.execute(DailyCorpus.__table__.delete().where(
+                DailyCorpus.day.in_(empty_days)
+            ))
+
+
+def _all_days() -> Set[date]:
+    first, last = db.session.query(
+        func.min(Article.date_published),
+        func.max(Article.date_published)
+    ).one()
+
+    if not first:
+        return set()
 
+    return {
+        first.date() + timedelta(days=i)
+        for i in range((last.date() - first.date()).days + 1)
+    }
 
-def get_text_blob(min: datetime, max: datetime) -> str:
-    results = Paragraph.query.join(Article).filter(
+
+def _paragraph_text(*criteria) -> Query:
+    return Paragraph.query.join(Article).filter(
+        *criteria
+    ).with_entities(
+        Paragraph.text
+    ).order_by(
+        Article.date_published,
+        Article.url,
+        Paragraph.id
+    )
+
+
+def _upsert(table: Table, rows: List[dict], key: str) -> Executable:
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).values(rows)
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(table).values(rows)
+    else:
+        raise NotImplementedError(f'Upserts are not supported on {dialect}.')
+
+    return statement.on_conflict_do_update(
+        index_elements=[key],
+        set_={i: statement.excluded[i] for i in rows[0] if i != key}
+    )
+
+
+def _chunks(items: List, size: int = 100) -> Iterator[List]:
+    # Keeps the number of bound parameters per statement under SQLite's limit.
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_last_ingest() -> Optional[datetime]:
+    '''Return the time of the most recent ingest, in UTC.'''
+    return db.session.query(IngestState.last_ingest).filter(
+        IngestState.id == 1
+    ).scalar()
+
+
+def iter_text_blob(
+    min: datetime,
+    max: datetime,
+    chunk_size: int = 1000
+) -> Iterator[str]:
+    '''
+    Yield the newline separated text of articles within a time range in
+    chunks. Whole days are read from the daily corpus, one row per day,
+    while partial days at either end fall back to reading paragraphs.
+    '''
+    # Daily corpus rows cover UTC days.
+    min, max = _as_naive_utc(min), _as_naive_utc(max)
+    first_day = min.date() if min.time() == time.min else min.date() + timedelta(days=1)
+    last_day = max.date() if max.time() == time.max else max.date() - timedelta(days=1)
+
+    if first_day > last_day:
+        yield from _join_chunks(_iter_paragraphs(
+            chunk_size,
+            Article.date_published >= min,
+            Article.date_published <= max
+        ))
+        return
+
+    head_end = datetime.combine(first_day, time())
+    tail_start = datetime.combine(last_day + timedelta(days=1), time())
+
+    yield from _join_chunks(chain(
+        _iter_paragraphs(
+            chunk_size,
+            Article.date_published >= min,
+            Article.date_published < head_end
+        ),
+        _iter_daily_corpus(first_day, last_day),
+        _iter_paragraphs(
+            chunk_size,
+            Article.date_published >= tail_start,
+            Article.date_published <= max
+        )
+    ))
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    # Dates are stored without a timezone, in UTC.
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _iter_paragraphs(chunk_size: int, *criteria) -> Iterator[str]:
+    # Read through a server-side cursor, batching rows into chunks.
+    results = _paragraph_text(*criteria).execution_options(
+        stream_results=True
+    ).yield_per(chunk_size)
+    batch = []
+
+    for (paragraph,) in results:
+        batch.append(paragraph)
+
+        if len(batch) >= chunk_size:
+            yield '\n'.join(batch)
+            batch = []
+
+    if batch:
+        yield '\n'.join(batch)
+
+
+def _iter_daily_corpus(first: date, last: date) -> Iterator[str]:
+    results = DailyCorpus.query.filter(
+        DailyCorpus.day >= first,
+        DailyCorpus.day <= last
+    ).with_entities(
+        DailyCorpus.text
+    ).order_by(
+        DailyCorpus.day
+    ).execution_options(
+        stream_results=True
+    ).yield_per(1)
+
+    for (compressed,) in results:
+        yield zlib.decompress(compressed).decode()
+
+
+def _join_chunks(chunks: Iterator[str]) -> Iterator[str]:
+    separator = ''
+
+    for chunk in chunks:
+        yield separator + chunk
+        separator = '\n'
+
+
+def get_article_hashes(min: datetime, max: datetime) -> Dict[str, str]:
+    results = Article.query.filter(
         Article.date_published >= min,
         Article.date_published <= max
-    ).with_entities(Paragraph.text).all()
-    return '\n'.join(map(lambda i: i[0], results))
+    ).with_entities(Article.url, Article.content_hash).all()
+    return {url: content_hash for url, content_hash in results if content_hash}
 
 
-def get_articles(min: datetime, max: datetime) -> List[DeserialisedArticle]:
-    results = Article.query.filter(
+def get_articles(
+    min: datetime,
+    max: datetime,
+    limit: Optional[int] = None
+) -> List[Article]:
+    '''
+    Fetch articles within a time range, ordered by publication date. When
+    a limit is given, a random sample of that many articles is taken by the
+    database. Paragraphs are loaded for all articles in one extra query.
+    '''
+    query = Article.query.options(
+        selectinload(Article.paragraphs)
+    ).filter(
         Article.date_published >= min,
         Article.date_published <= max
-    ).order_by(
-        Article.date_published
-    ).all()
-    return list(map(
-        lambda i: DeserialisedArticle(
-            i.url,
-            i.title,
-            i.date_published,
-            i.paragraphs,
-            [],
-            i.category
-        ),
-        results
-    ))
+    )
 
+    if limit is None:
+        return query.order_by(Article.date_published).all()
 
-def articles_by_date_published(year: int) -> Dict[str, int]:
-    query_result = db.session.query(Article.date_published).filter(
-        Article.date_published >= datetime(year, 1, 1),
-        Article.date_published <= datetime(year, 12, 31)
-    ).all()
+    return sorted(
+        query.order_by(func.random()).limit(limit),
+        key=lambda i: i.date_published
+    )
 
-    result = {}
 
-    for date in sorted(map(lambda i: i[0], query_result)):
-        ymd = date.strftime('%Y/%m/%d')
-        result[ymd] = result.get(ymd, 0) + 1
+def articles_by_date_published(year: int) -> Dict[str, int]:
+    query_result = DailyArticleCount.query.filter(
+        DailyArticleCount.day >= date(year, 1, 1),
+        DailyArticleCount.day < date(year + 1, 1, 1)
+    ).order_by(DailyArticleCount.day)
 
-    return result
+    return {i.day.strftime('%Y/%m/%d'): i.count for i in query_result}
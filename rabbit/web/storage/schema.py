@@ -1,25 +1,41 @@
-from flask_sqlalchemy import SQLAlchemy
-
-
-db = SQLAlchemy()
-
-
-class Paragraph(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    text = db.Column(db.String, nullable=False)
-    article_url = db.Column(db.String, db.ForeignKey('article.url'))
-
-    def __str__(self: object):
-        return f'{self.text}'
-
-
-class Article(db.Model):
-    url = db.Column(db.String, primary_key=True)
-    title = db.Column(db.String, nullable=False)
-    category = db.Column(db.String, nullable=False)
-    date_published = db.Column(db.DateTime, nullable=False)
-    paragraphs = db.relationship(
-        'Paragraph',
-        order_by=Paragraph.id,
-        backref='article'
-    )
\ No newline at end of file
+from flask_sqlalchemy import SQLAlchemy
+
+
+db = SQLAlchemy()
+
+
+class Paragraph(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String, nullable=False)
+    article_url = db.Column(db.String, db.ForeignKey('article.url'), index=True)
+
+    def __str__(self: object):
+        return f'{self.text}'
+
+
+class Article(db.Model):
+    url = db.Column(db.String, primary_key=True)
+    title = db.Column(db.String, nullable=False)
+    category = db.Column(db.String, nullable=False)
+    date_published = db.Column(db.DateTime, nullable=False, index=True)
+    content_hash = db.Column(db.String)
+    paragraphs = db.relationship(
+        'Paragraph',
+        order_by=Paragraph.id,
+        backref='article'
+    )
+
+
+class DailyArticleCount(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+
+class DailyCorpus(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    text = db.Column(db.LargeBinary, nullable=False)
+
+
+class IngestState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    last_ingest = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
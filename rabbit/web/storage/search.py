@@ -0,0 +1,208 @@
+from collections import namedtuple
+from typing import List, Tuple
+
+from sqlalchemy import DateTime, text
+
+from ...article import Article as DeserialisedArticle
+from .schema import db
+
+
+SearchResult = namedtuple(
+    'SearchResult',
+    ['url', 'title', 'category', 'date_published', 'rank']
+)
+
+
+# One document per article, titles weighted above body text. SQLite uses
+# an FTS5 table holding its own copy of the text, PostgreSQL a tsvector
+# column with a GIN index.
+#
+# FTS5 rows share the rowid of their article, so that replacing one is a
+# rowid lookup rather than a scan. Article rowids are stable as long as the
+# table is upserted and never vacuumed. The first version keyed rows on an
+# unindexed url column in article_search, which is dropped and rebuilt.
+SQLITE_SCHEMA = [
+    'DROP TABLE IF EXISTS article_search',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS article_fts USING fts5(
+        title, body, tokenize = 'porter unicode61'
+    )
+    '''
+]
+
+POSTGRESQL_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS article_search (
+        url VARCHAR PRIMARY KEY REFERENCES article (url),
+        document TSVECTOR NOT NULL
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS article_search_document
+    ON article_search USING GIN (document)
+    '''
+]
+
+# Only while the index is still empty, checked in the same statement so
+# that concurrent startups cannot both fill it.
+SQLITE_BACKFILL = '''
+    INSERT INTO article_fts (rowid, title, body)
+    SELECT article.rowid, article.title, group_concat(paragraph.text, char(10))
+    FROM article LEFT JOIN paragraph ON paragraph.article_url = article.url
+    WHERE NOT EXISTS (SELECT 1 FROM article_fts)
+    GROUP BY article.rowid
+'''
+
+SQLITE_DELETE = '''
+    DELETE FROM article_fts
+    WHERE rowid = (SELECT rowid FROM article WHERE url = :url)
+'''
+
+SQLITE_INSERT = '''
+    INSERT INTO article_fts (rowid, title, body)
+    SELECT rowid, :title, :body FROM article WHERE url = :url
+'''
+
+POSTGRESQL_BACKFILL = '''
+    INSERT INTO article_search (url, document)
+    SELECT
+        article.url,
+        setweight(to_tsvector('english', article.title), 'A') ||
+        setweight(to_tsvector('english', coalesce(
+            string_agg(paragraph.text, E'\\n' ORDER BY paragraph.id), ''
+        )), 'B')
+    FROM article LEFT JOIN paragraph ON paragraph.article_url = article.url
+    WHERE NOT EXISTS (SELECT 1 FROM article_search)
+    GROUP BY article.url
+'''
+
+POSTGRESQL_UPSERT = '''
+    INSERT INTO article_search (url, document)
+    VALUES (
+        :url,
+        setweight(to_tsvector('english', :title), 'A') ||
+        setweight(to_tsvector('english', :body), 'B')
+    )
+    ON CONFLICT (url) DO UPDATE SET document = excluded.document
+'''
+
+# bm25() is lower for better matches and takes a weight per column.
+SQLITE_SEARCH = '''
+    SELECT
+        article.url, article.title, article.category,
+        article.date_published, -bm25(article_fts, 10, 1) AS rank
+    FROM article_fts JOIN article ON article.rowid = article_fts.rowid
+    WHERE article_fts MATCH :query
+    ORDER BY rank DESC, article.date_published DESC
+    LIMIT :limit OFFSET :offset
+'''
+
+SQLITE_COUNT = '''
+    SELECT count(*) FROM article_fts WHERE article_fts MATCH :query
+'''
+
+POSTGRESQL_SEARCH = '''
+    SELECT
+        article.url, article.title, article.category,
+        article.date_published, ts_rank_cd(document, query) AS rank
+    FROM article_search
+    JOIN article ON article.url = article_search.url,
+    plainto_tsquery('english', :query) AS query
+    WHERE document @@ query
+    ORDER BY rank DESC, article.date_published DESC
+    LIMIT :limit OFFSET :offset
+'''
+
+POSTGRESQL_COUNT = '''
+    SELECT count(*) FROM article_search
+    WHERE document @@ plainto_tsquery('english', :query)
+'''
+
+
+def _dialect() -> str:
+    dialect = db.engine.dialect.name
+
+    if dialect not in ('postgresql', 'sqlite'):
+        raise NotImplementedError(f'Search is not supported on {dialect}.')
+
+    return dialect
+
+
+def initialise_search() -> None:
+    '''
+    Create the search index, filling it from existing articles if empty.
+    Callers run this in one process at a time, see initialise_storage.
+    '''
+    dialect = _dialect()
+    schema = SQLITE_SCHEMA if dialect == 'sqlite' else POSTGRESQL_SCHEMA
+
+    for statement in schema:
+        db.session.execute(text(statement))
+
+    db.session.commit()
+
+    table = 'article_fts' if dialect == 'sqlite' else 'article_search'
+
+    if db.session.execute(text(f'SELECT 1 FROM {table} LIMIT 1')).first():
+        return
+
+    db.session.execute(text(
+        SQLITE_BACKFILL if dialect == 'sqlite' else POSTGRESQL_BACKFILL
+    ))
+    db.session.commit()
+
+
+def index_articles(articles: List[DeserialisedArticle]) -> None:
+    '''Replace the indexed text of the given articles.'''
+    rows = [
+        {'url': i.url, 'title': i.title, 'body': '\n'.join(i.content)}
+        for i in articles
+    ]
+
+    if not rows:
+        return
+
+    if _dialect() == 'postgresql':
+        db.session.execute(text(POSTGRESQL_UPSERT), rows)
+        return
+
+    # FTS5 tables have no unique constraint to upsert against. The articles
+    # were upserted first, so each has a rowid to replace its row by.
+    db.session.execute(text(SQLITE_DELETE), [{'url': i['url']} for i in rows])
+    db.session.execute(text(SQLITE_INSERT), rows)
+
+
+def _fts5_query(query: str) -> str:
+    # Quote every term so that user input is never parsed as FTS5 syntax,
+    # matching documents containing all of them like plainto_tsquery.
+    return ' '.join('"' + i.replace('"', '""') + '"' for i in query.split())
+
+
+def search_articles(
+    query: str,
+    limit: int,
+    offset: int = 0
+) -> Tuple[int, List[SearchResult]]:
+    '''
+    Search article titles and text, best matches first. Returns the total
+    number of matches along with the requested page of results.
+    '''
+    if _dialect() == 'sqlite':
+        query = _fts5_query(query)
+        search, count = SQLITE_SEARCH, SQLITE_COUNT
+    else:
+        search, count = POSTGRESQL_SEARCH, POSTGRESQL_COUNT
+
+    if not query.strip():
+        return 0, []
+
+    total = db.session.execute(text(count), {'query': query}).scalar()
+    rows = db.session.execute(text(search).columns(
+        date_published=DateTime
+    ), {
+        'query': query,
+        'limit': limit,
+        'offset': offset
+    })
+
+    return total, [SearchResult(*i) for i in rows]